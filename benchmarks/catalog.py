@@ -0,0 +1,256 @@
+"""Synthetic Spotify catalog, served in-process through a requests transport adapter
+or over HTTP by mock_server.py."""
+
+import json
+import re
+import threading
+from datetime import date, timedelta
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+from requests.adapters import BaseAdapter
+
+RELEASE_RADAR_ID = "spotify-release-radar"
+# order of the groups in an artist's albums listing, each one from newest to oldest
+ALBUM_GROUPS = ["album", "single", "compilation", "appears_on"]
+
+
+class Catalog:
+    """'n_artists' followed artists, each with 'new_albums' releases of the last days
+    plus 'old_albums' older ones, every album holding 'tracks_per_album' tracks.
+    The user owns a custom 'Release Radar (<date>)' playlist and a '<artist>: Top Songs'
+    playlist for the first 'top_songs_playlists' artists; Spotify's own Release Radar
+    has the id RELEASE_RADAR_ID. Playlist writes are applied, each one bumping the
+    playlist's snapshot id; tracks added to the playback queue are kept in 'queue'."""
+
+    def __init__(
+        self,
+        n_artists: int = 1000,
+        new_albums: int = 2,
+        old_albums: int = 3,
+        tracks_per_album: int = 5,
+        top_songs_playlists: int = 10,
+        today: date = None,
+    ):
+        today = today or date.today()
+        self.artists = [
+            {
+                "id": f"ar{i}",
+                "name": f"Artist {i}",
+                "genres": [],
+                "popularity": i % 100,
+                "type": "artist",
+                "uri": f"spotify:artist:ar{i}",
+            }
+            for i in range(n_artists)
+        ]
+        self.artists_by_id = {artist["id"]: artist for artist in self.artists}
+        self.albums: dict[str, list[dict]] = {}
+        self.albums_by_id: dict[str, dict] = {}
+        self.tracks: dict[str, list[dict]] = {}
+        self.tracks_by_id: dict[str, dict] = {}
+        for artist in self.artists:
+            ref = {"id": artist["id"], "name": artist["name"]}
+            albums = []
+            for k in range(new_albums + old_albums):
+                album_id = f"{artist['id']}al{k}"
+                days = k if k < new_albums else 30 * (k + 1)
+                album = {
+                    "id": album_id,
+                    "name": f"{artist['name']} album {k}",
+                    "album_type": "single" if k % 2 else "album",
+                    "album_group": "single" if k % 2 else "album",
+                    "release_date": (today - timedelta(days=days)).isoformat(),
+                    "release_date_precision": "day",
+                    "total_tracks": tracks_per_album,
+                    "artists": [ref],
+                    "uri": f"spotify:album:{album_id}",
+                }
+                albums.append(album)
+                self.albums_by_id[album_id] = album
+                self.tracks[album_id] = [
+                    {
+                        "id": f"{album_id}t{t}",
+                        "name": f"{artist['name']} song {k}.{t}",
+                        "uri": f"spotify:track:{album_id}t{t}",
+                        "artists": [ref],
+                        "track_number": t + 1,
+                        "explicit": False,
+                        "popularity": (7 * k + 13 * t) % 100,
+                    }
+                    for t in range(tracks_per_album)
+                ]
+                for track in self.tracks[album_id]:
+                    self.tracks_by_id[track["id"]] = {
+                        **track,
+                        "album": album,
+                        "external_ids": {"isrc": f"QZ{track['id'].upper()}"},
+                    }
+            self.albums[artist["id"]] = albums
+
+        self.playlists = [
+            {"id": "release-radar", "name": "Release Radar (Jan 01)", "tracks": []},
+            *[
+                {"id": f"top{i}", "name": f"{artist['name']}: Top Songs", "tracks": []}
+                for i, artist in enumerate(self.artists[:top_songs_playlists])
+            ],
+        ]
+        radar = [
+            self.tracks_by_id[track["id"]]
+            for artist in self.artists[::10]
+            for track in self.tracks[self.albums[artist["id"]][0]["id"]]
+        ]
+        self.playlist_tracks = {RELEASE_RADAR_ID: radar}
+        self.snapshots: dict[str, int] = {}
+        self.queue: list[str] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def page(items: list, offset: int, limit: int) -> dict:
+        end = offset + limit
+        return {
+            "items": items[offset:end],
+            "total": len(items),
+            "limit": limit,
+            "offset": offset,
+            "next": "next" if end < len(items) else None,
+        }
+
+    def _track(self, uri: str) -> dict:
+        track_id = uri.split(":")[-1]
+        return self.tracks_by_id.get(track_id) or {
+            "id": track_id,
+            "name": uri,
+            "uri": uri,
+        }
+
+    def write_playlist(self, method: str, playlist_id: str, body: dict) -> dict:
+        """Apply an add (POST), replace / reorder (PUT) or remove (DELETE) of items."""
+        with self._lock:
+            items = self.playlist_tracks.setdefault(playlist_id, [])
+            if method == "POST":
+                position = body.get("position", len(items))
+                items[position:position] = [self._track(x) for x in body["uris"]]
+            elif method == "PUT" and "uris" in body:
+                items[:] = [self._track(x) for x in body["uris"]]
+            elif method == "PUT":
+                start, before = body["range_start"], body["insert_before"]
+                length = body.get("range_length", 1)
+                moved = items[start : start + length]
+                del items[start : start + length]
+                before -= length if before > start else 0
+                items[before:before] = moved
+            elif method == "DELETE":
+                removed = {x["uri"] for x in body["tracks"]}
+                items[:] = [x for x in items if x["uri"] not in removed]
+            self.snapshots[playlist_id] = self.snapshots.get(playlist_id, 0) + 1
+            return {"snapshot_id": self.snapshot_id(playlist_id)}
+
+    def snapshot_id(self, playlist_id: str) -> str:
+        return f"{playlist_id}-{self.snapshots.get(playlist_id, 0)}"
+
+    def route(
+        self, method: str, path: str, params: dict, body: dict = None
+    ) -> tuple[int, dict]:
+        """Answer a request like the Web API would, (404, ...) if it isn't supported."""
+        offset, limit = int(params.get("offset", 0)), int(params.get("limit", 20))
+        ids = params["ids"].split(",") if params.get("ids") else []
+        if path == "api/token":
+            return 200, {"access_token": "token", "expires_in": 3600}
+        if method == "POST" and re.fullmatch(r"users/[^/]+/playlists", path):
+            return 201, {"id": f"playlist{len(self.playlists)}"}
+        if m := re.fullmatch(r"playlists/([^/]+)/tracks", path):
+            if method != "GET":
+                return 200, self.write_playlist(method, m[1], body or {})
+        if method == "POST" and path == "me/player/queue":
+            with self._lock:
+                self.queue.append(params["uri"])
+            return 200, {}
+        if method != "GET":
+            return 200, {"snapshot_id": "snapshot"}
+        if path == "me/following":
+            after = params.get("after")
+            start = int(after[2:]) + 1 if after else 0
+            items = self.artists[start : start + limit]
+            last = items[-1]["id"] if start + limit < len(self.artists) else None
+            return 200, {"artists": {"items": items, "cursors": {"after": last}}}
+        if path == "me/playlists":
+            return 200, self.page(self.playlists, offset, limit)
+        if path == "search":
+            name = params.get("q", "").lower()
+            items = [x for x in self.artists if x["name"].lower() == name]
+            return 200, {"artists": self.page(items, offset, limit)}
+        if path == "artists":
+            return 200, {"artists": [self.artists_by_id.get(x) for x in ids]}
+        if path == "albums":
+            albums = [
+                {**self.albums_by_id[x], "tracks": self.page(self.tracks[x], 0, 50)}
+                if x in self.albums_by_id
+                else None
+                for x in ids
+            ]
+            return 200, {"albums": albums}
+        if path == "tracks":
+            return 200, {"tracks": [self.tracks_by_id.get(x) for x in ids]}
+        if m := re.fullmatch(r"artists/([^/]+)", path):
+            if m[1] in self.artists_by_id:
+                return 200, self.artists_by_id[m[1]]
+        if m := re.fullmatch(r"artists/([^/]+)/albums", path):
+            groups = params.get("include_groups", "album,single").split(",")
+            items = [x for x in self.albums.get(m[1], []) if x["album_group"] in groups]
+            items.sort(key=lambda x: ALBUM_GROUPS.index(x["album_group"]))
+            return 200, self.page(items, offset, limit)
+        if m := re.fullmatch(r"playlists/([^/]+)", path):
+            items = [{"track": x} for x in self.playlist_tracks.get(m[1], [])]
+            return 200, {
+                "id": m[1],
+                "snapshot_id": self.snapshot_id(m[1]),
+                "tracks": self.page(items, 0, 100),
+            }
+        if m := re.fullmatch(r"albums/([^/]+)/tracks", path):
+            return 200, self.page(self.tracks.get(m[1], []), offset, limit)
+        if m := re.fullmatch(r"playlists/([^/]+)/tracks", path):
+            items = [{"track": x} for x in self.playlist_tracks.get(m[1], [])]
+            return 200, self.page(items, offset, limit)
+        return 404, {"error": {"status": 404, "message": "Not found"}}
+
+
+class CatalogAdapter(BaseAdapter):
+    """Serve a Catalog to a requests.Session, no socket involved."""
+
+    def __init__(self, catalog: Catalog):
+        super().__init__()
+        self.catalog = catalog
+        self.requests = 0
+
+    def send(self, request, **kwargs) -> requests.Response:
+        self.requests += 1
+        url = urlparse(request.url)
+        params = dict(parse_qsl(url.query))
+        path = re.sub(r"^/(v1/)?", "", url.path)
+        status, body = self.catalog.route(
+            request.method, path, params, _json_body(request)
+        )
+
+        r = requests.Response()
+        r.status_code = status
+        r._content = json.dumps(body).encode()
+        r.headers["Content-Type"] = "application/json"
+        r.url = request.url
+        r.request = request
+        return r
+
+    def close(self) -> None:
+        pass
+
+
+def _json_body(request) -> dict | None:
+    if not request.body or "json" not in request.headers.get("Content-Type", ""):
+        return None
+    return json.loads(request.body)
+
+
+def catalog_session(catalog: Catalog) -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", CatalogAdapter(catalog))
+    return session
@@ -0,0 +1,121 @@
+"""Release radar collection: per-request DataFrames accumulated with pd.concat
+versus the record pipeline of jobs/update_release_radar.py (lib.releases: the tracks of
+20 albums per request, then 50 tracks per request for their ISRC).
+
+    uv run benchmarks/collect_releases.py [--artists 1000] [--tracks-per-album 5]
+
+Both run serially (one chunk of albums at a time) against an in-process synthetic catalog (see catalog.py),
+so only the client code and the collection itself are measured."""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append((ROOT_DIR / "src").as_posix())
+sys.path.append(ROOT_DIR.as_posix())
+
+# the job module reads its settings at import, none of them is used here
+for name in [
+    "USER_ID",
+    "RELEASE_RADAR_ID",
+    "SPOTIFY_CLIENT_BASE_64",
+    "SPOTIFY_REFRESH_TOKEN",
+    "SPOTIPY_CLIENT_ID",
+    "SPOTIPY_CLIENT_SECRET",
+    "SPOTIPY_REDIRECT_URI",
+    "SPOTIPY_SCOPE",
+    "SYSLOG_ADDRESS",
+    "GMAIL_PASSWORD",
+]:
+    os.environ.setdefault(name, "0")
+os.environ.setdefault("GMAIL_ADDRESS", "benchmark@example.com")
+
+from benchmarks.catalog import Catalog, catalog_session  # noqa: E402
+from jobs.update_release_radar import END_DATE, START_DATE  # noqa: E402
+from lib.client import Spotify  # noqa: E402
+from lib.models import TrackIndex  # noqa: E402
+from lib.releases import (  # noqa: E402
+    albums_not_in_radar,
+    fetch_tracks,
+    release_record,
+    tracks_uris,
+)
+
+
+def concat_collection(spotify: Spotify, artist_ids: list[str]) -> list[str]:
+    """The previous implementation: one DataFrame per request, concatenated in the loop."""
+    new_albums = pd.DataFrame(columns=["id", "name"])
+    for artist_id in artist_ids:
+        releases = spotify.get_artist_releases(artist_id, START_DATE, END_DATE)
+        new_albums = pd.concat([new_albums, releases.reindex(columns=["id", "name"])])
+    new_albums = new_albums.drop_duplicates(subset=["name"], keep="first")
+
+    tracks = pd.DataFrame()
+    for album_id in new_albums["id"]:
+        tracks = pd.concat([tracks, spotify.get_tracks_from_album(album_id)])
+    tracks = tracks.drop_duplicates("name", keep="first")
+    tracks = tracks.explode("artists")
+    tracks["artist_name"] = [x["name"] for x in tracks["artists"]]
+    names = [artist.name for artist in spotify.artists]
+    tracks = tracks.query(f"artist_name.isin({names})").drop_duplicates("uri")
+    return tracks["uri"].to_list()
+
+
+def record_collection(spotify: Spotify, artist_ids: list[str]) -> list[str]:
+    """The job's pipeline: release records, then the tracks of 20 albums at a time."""
+    new_albums = (
+        release_record(x)
+        for artist_id in artist_ids
+        for x in spotify.iter_artist_releases(artist_id, START_DATE, END_DATE)
+    )
+    radar = TrackIndex()
+    album_ids = albums_not_in_radar(new_albums, radar)
+    tracks = fetch_tracks(spotify, album_ids, max_workers=1)
+    artists_names = [artist.name for artist in spotify.artists]
+    return list(tracks_uris(tracks, artists_names, radar))
+
+
+def measure(func, catalog: Catalog) -> dict:
+    spotify = Spotify(0, "refresh", "base64", session=catalog_session(catalog))
+    spotify.rate_limiter.acquire = lambda: 0.0  # measure the code, not the limiter
+    artist_ids = spotify.get_favorite_artists()
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    uris = func(spotify, artist_ids)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "tracks": len(uris),
+        "seconds": round(elapsed, 3),
+        "peak_mb": peak / 1024**2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--artists", type=int, default=1000)
+    parser.add_argument("--tracks-per-album", type=int, default=5)
+    args = parser.parse_args()
+
+    catalog = Catalog(n_artists=args.artists, tracks_per_album=args.tracks_per_album)
+    for name, func in [
+        ("pd.concat", concat_collection),
+        ("records", record_collection),
+    ]:
+        result = measure(func, catalog)
+        print(
+            f"{name:>10}: {result['tracks']} tracks in {result['seconds']:.2f}s, "
+            f"peak memory {result['peak_mb']:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
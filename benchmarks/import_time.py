@@ -0,0 +1,64 @@
+"""Measure how long importing each job takes, i.e. its startup cost before any request.
+
+    uv run benchmarks/import_time.py [--jobs like_new_albums] [--top 10]
+
+Each import runs in a fresh interpreter with '-X importtime'; the best of a few
+runs is kept, the slowest modules it pulled in are listed below each job."""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(ROOT_DIR.as_posix())
+
+
+def import_times(job: str, env: dict) -> dict[str, float]:
+    """Cumulative import time (ms) of every module imported by 'jobs.<job>'."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import jobs.{job}"],
+        env={**env, "PYTHONPATH": (ROOT_DIR / "src").as_posix()},
+        cwd=ROOT_DIR / "src",
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {job} failed:\n{process.stderr}")
+    times = {}
+    # lines: 'import time: <self us> | <cumulative us> | <indented module name>'
+    for line in process.stderr.splitlines()[1:]:
+        _, cumulative, module = line.split("|")
+        times.setdefault(module.strip(), int(cumulative) / 1000)
+    return times
+
+
+def import_ms(job: str, env: dict, runs: int = 3) -> float:
+    """Best of 'runs' import times of 'jobs.<job>', in ms."""
+    return round(min(import_times(job, env)[f"jobs.{job}"] for _ in range(runs)), 1)
+
+
+def main() -> None:
+    from benchmarks.run import JOBS, SETTINGS
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", nargs="+", choices=JOBS, default=JOBS)
+    parser.add_argument("--top", type=int, default=10, help="slowest modules listed")
+    args = parser.parse_args()
+
+    env = {**os.environ, **SETTINGS}
+    for job in args.jobs:
+        print(f"{job:<22} {import_ms(job, env):>8.1f} ms")
+        times = import_times(job, env)
+        top_level = {
+            module: ms
+            for module, ms in times.items()
+            if "." not in module and module != "jobs"
+        }
+        for module, ms in sorted(top_level.items(), key=lambda x: -x[1])[: args.top]:
+            print(f"    {module:<30} {ms:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Run a Python script and write its peak RSS (in MB) to the file given as first argument.
+
+    python benchmarks/measure.py <rss_file> <script> [args...]
+
+The parent's rusage can't be used for this: on Linux, the peak RSS of a child
+includes the memory of the process it was forked from."""
+
+import resource
+import runpy
+import sys
+from pathlib import Path
+
+
+def peak_rss_mb() -> float:
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+if __name__ == "__main__":
+    rss_file, script = sys.argv[1:3]
+    sys.argv = sys.argv[2:]
+    try:
+        runpy.run_path(script, run_name="__main__")
+    finally:
+        Path(rss_file).write_text(f"{peak_rss_mb():.1f}")
@@ -0,0 +1,243 @@
+"""Local stand-in for the Spotify Web API and token endpoint.
+
+    uv run benchmarks/mock_server.py --artists 1000 --latency 0.02 --rate-429 0.01
+
+then point the jobs at it with the printed SPOTIFY_API_URL / SPOTIFY_TOKEN_URL.
+
+Requests are answered from, in that order:
+- recorded fixtures (--fixtures DIR), one JSON file per request;
+- the upstream API (--record URL), saving each response as a fixture. Keep the real
+  token endpoint so that upstream accepts the forwarded 'Authorization' header;
+- a synthetic catalog (see catalog.py)."""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+from benchmarks.catalog import Catalog  # noqa: E402
+
+
+class Fixtures:
+    """Directory of recorded responses, keyed by method, path and sorted query."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(method: str, path: str, params: dict) -> str:
+        return f"{method} {path}?{urlencode(sorted(params.items()))}"
+
+    def _file(self, key: str) -> Path:
+        return self.path / f"{hashlib.sha1(key.encode()).hexdigest()[:16]}.json"
+
+    def load(self, key: str) -> tuple[int, bytes] | None:
+        file = self._file(key)
+        if not file.exists():
+            return None
+        fixture = json.loads(file.read_text())
+        return fixture["status"], json.dumps(fixture["body"]).encode()
+
+    def save(self, key: str, status: int, body: bytes) -> None:
+        fixture = {"request": key, "status": status, "body": json.loads(body or "{}")}
+        self._file(key).write_text(json.dumps(fixture, indent=1))
+
+
+class MockServer:
+    """Threaded HTTP server answering like the Web API, with optional latency and
+    randomly injected 429s ('rate_429' of the API requests). Usable as a context manager."""
+
+    def __init__(
+        self,
+        catalog: Catalog = None,
+        fixtures: str = None,
+        record: str = None,
+        latency: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 0,
+    ):
+        self.catalog = catalog if catalog is not None else Catalog()
+        self.fixtures = Fixtures(fixtures) if fixtures is not None else None
+        self.record = record
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "connections": 0,
+            "bytes": 0,
+            "throttled": 0,
+            "replayed": 0,
+        }
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    @property
+    def token_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/token"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def connected(self) -> None:
+        """Count a new client connection (the others are reused, keep-alive)."""
+        with self._lock:
+            self._stats["connections"] += 1
+
+    def answer(
+        self, method: str, path: str, params: dict, headers, body: bytes = b""
+    ) -> tuple:
+        """(status, headers, body) of a request."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self._stats["requests"] += 1
+            throttle = path != "api/token" and self._random.random() < self.rate_429
+            if throttle:
+                self._stats["throttled"] += 1
+        if throttle:
+            return 429, {"Retry-After": str(self.retry_after)}, b""
+
+        key = Fixtures.key(method, path, params)
+        replay = self.fixtures.load(key) if self.fixtures is not None else None
+        if replay is not None:
+            status, body = replay
+            with self._lock:
+                self._stats["replayed"] += 1
+        elif self.record is not None and path != "api/token":
+            r = requests.request(
+                method,
+                self.record + path,
+                params=params,
+                data=body or None,
+                headers={
+                    "Authorization": headers.get("Authorization", ""),
+                    "Content-Type": "application/json",
+                },
+            )
+            status, body = r.status_code, r.content
+            if self.fixtures is not None and r.ok:
+                self.fixtures.save(key, status, body)
+        else:
+            is_json = "json" in headers.get("Content-Type", "")
+            payload = json.loads(body) if body and is_json else None
+            status, payload = self.catalog.route(method, path, params, payload)
+            body = json.dumps(payload).encode()
+
+        with self._lock:
+            self._stats["bytes"] += len(body)
+        return status, {"Content-Type": "application/json"}, body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # else each response waits for a delayed ACK
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.mock.connected()
+
+    def _handle(self) -> None:
+        payload = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        url = urlparse(self.path)
+        path = url.path.removeprefix("/").removeprefix("v1/")
+        status, headers, body = self.server.mock.answer(
+            self.command, path, dict(parse_qsl(url.query)), self.headers, payload
+        )
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _handle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--artists", type=int, default=1000)
+    parser.add_argument("--albums", type=int, default=5, help="albums per artist")
+    parser.add_argument("--tracks-per-album", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--fixtures", help="directory of recorded responses")
+    parser.add_argument("--record", help="upstream API to record from")
+    args = parser.parse_args()
+
+    catalog = Catalog(
+        n_artists=args.artists,
+        old_albums=max(args.albums - 2, 0),
+        tracks_per_album=args.tracks_per_album,
+    )
+    server = MockServer(
+        catalog,
+        fixtures=args.fixtures,
+        record=args.record,
+        latency=args.latency,
+        rate_429=args.rate_429,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"SPOTIFY_API_URL={server.url}")
+    print(f"SPOTIFY_TOKEN_URL={server.token_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Run the jobs (and run_all) against synthetic catalogs and track their performance.
+
+    uv run benchmarks/run.py [--scenarios 100 1k] [--jobs like_new_albums] [--threshold 0.2]
+
+Each job runs in its own process (cold cache and state) against mock_server.py.
+Wall time, request count, connections opened (and reused, i.e. the TLS handshakes
+saved against the real API), bytes transferred, peak RSS and import time (see
+import_time.py) are appended to a JSON history file; the run fails (exit code 1)
+when a metric gets worse than in the last accepted run by more than the threshold."""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(ROOT_DIR.as_posix())
+
+from benchmarks.catalog import RELEASE_RADAR_ID, Catalog  # noqa: E402
+from benchmarks.import_time import import_ms  # noqa: E402
+from benchmarks.mock_server import MockServer  # noqa: E402
+
+JOBS = ["like_new_albums", "update_release_radar", "update_top_songs", "run_all"]
+SCENARIOS = {
+    "100": {"n_artists": 100},
+    "1k": {"n_artists": 1000},
+    "5k": {"n_artists": 5000},
+    "prolific": {"n_artists": 20, "old_albums": 500, "top_songs_playlists": 3},
+    # accounts following the same artists (the mock serves one library to every user)
+    "team": {"n_artists": 100, "accounts": 10},
+}
+# tracked for regressions ('reused' is reported only, the more the better)
+METRICS = ["wall_s", "requests", "connections", "bytes", "peak_rss_mb", "import_ms"]
+SETTINGS = {
+    "GMAIL_ADDRESS": "benchmark@example.com",
+    "GMAIL_PASSWORD": "-",
+    "USER_ID": "0",
+    "RELEASE_RADAR_ID": RELEASE_RADAR_ID,
+    "SPOTIFY_CLIENT_BASE_64": "-",
+    "SPOTIFY_REFRESH_TOKEN": "-",
+    "SPOTIPY_CLIENT_ID": "-",
+    "SPOTIPY_CLIENT_SECRET": "-",
+    "SPOTIPY_REDIRECT_URI": "-",
+    "SPOTIPY_SCOPE": "-",
+    "SYSLOG_ADDRESS": "-",
+}
+
+
+def run_job(job: str, server: MockServer, rate_limit: float, accounts: int = 1) -> dict:
+    """Run a job in a fresh process, for 'accounts' users, and measure it."""
+    others = [
+        {
+            "user_id": f"user-{i}",
+            "refresh_token": f"-{i}",
+            "release_radar_id": RELEASE_RADAR_ID,
+        }
+        for i in range(1, accounts)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            **SETTINGS,
+            "SPOTIFY_API_URL": server.url,
+            "SPOTIFY_TOKEN_URL": server.token_url,
+            "RATE_LIMIT": str(rate_limit),
+            "CACHE_PATH": f"{tmp}/cache.sqlite",
+            "STATE_PATH": f"{tmp}/state.sqlite",
+            "TOKEN_PATH": f"{tmp}/token.json",
+            "ACCOUNTS": json.dumps(others),
+        }
+        server.reset_stats()
+        t0 = time.perf_counter()
+        process = subprocess.run(
+            [
+                sys.executable,
+                (ROOT_DIR / "benchmarks" / "measure.py").as_posix(),
+                f"{tmp}/rss",
+                (ROOT_DIR / "src" / "jobs" / f"{job}.py").as_posix(),
+            ],
+            env=env,
+            cwd=tmp,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        wall = time.perf_counter() - t0
+        if process.returncode != 0:
+            raise RuntimeError(f"{job} failed:\n{process.stdout.decode()}")
+        peak_rss = float(Path(f"{tmp}/rss").read_text())
+    stats = server.stats()
+    return {
+        "wall_s": round(wall, 3),
+        "requests": stats["requests"],
+        "connections": stats["connections"],
+        "reused": stats["requests"] - stats["connections"],
+        "bytes": stats["bytes"],
+        "peak_rss_mb": peak_rss,
+        "import_ms": import_ms(job, env),
+    }
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Metrics worse than in 'baseline' by more than 'threshold' (relative)."""
+    found = []
+    for scenario, jobs in results.items():
+        for job, metrics in jobs.items():
+            before = baseline.get(scenario, {}).get(job)
+            if before is None:
+                continue
+            for metric in METRICS:
+                if metric not in before:  # not tracked yet by that run
+                    continue
+                if metrics[metric] > before[metric] * (1 + threshold):
+                    found.append(
+                        f"{scenario}/{job}: {metric} {before[metric]} -> {metrics[metric]}"
+                    )
+    return found
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument("--jobs", nargs="+", choices=JOBS, default=JOBS)
+    parser.add_argument(
+        "--history", default=(ROOT_DIR / "benchmarks" / "history.json").as_posix()
+    )
+    parser.add_argument("--threshold", type=float, default=0.2, help="e.g. 0.2 = +20%%")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="mock API latency (s)"
+    )
+    parser.add_argument(
+        "--rate-limit", type=float, default=1000.0, help="client requests/s"
+    )
+    parser.add_argument(
+        "--no-save", action="store_true", help="don't append to history"
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for scenario in args.scenarios:
+        options = dict(SCENARIOS[scenario])
+        accounts = options.pop("accounts", 1)
+        with MockServer(Catalog(**options), latency=args.latency) as server:
+            for job in args.jobs:
+                metrics = run_job(job, server, args.rate_limit, accounts)
+                results.setdefault(scenario, {})[job] = metrics
+                print(
+                    f"{scenario:>8} {job:<22} "
+                    + "  ".join(f"{k}={v}" for k, v in metrics.items())
+                )
+
+    history_file = Path(args.history)
+    history = json.loads(history_file.read_text()) if history_file.exists() else []
+    accepted = [entry for entry in history if not entry["regressions"]]
+    found = (
+        regressions(results, accepted[-1]["results"], args.threshold)
+        if accepted
+        else []
+    )
+    for regression in found:
+        print(f"REGRESSION {regression}")
+
+    if not args.no_save:
+        history.append(
+            {
+                "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "commit": _commit(),
+                "threshold": args.threshold,
+                "results": results,
+                "regressions": found,
+            }
+        )
+        history_file.write_text(json.dumps(history, indent=2))
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
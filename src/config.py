@@ -1,7 +1,20 @@
-from pydantic import EmailStr, SecretStr
+from pydantic import BaseModel, EmailStr, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class Account(BaseModel):
+    """A Spotify user the jobs run for."""
+
+    user_id: str
+    refresh_token: str
+    release_radar_id: str  # the user's own 'Release Radar' playlist
+    name: str | None = None  # in the logs, default: user_id
+
+    @property
+    def label(self) -> str:
+        return self.name or self.user_id
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", extra="forbid")
 
@@ -20,5 +33,37 @@ class Settings(BaseSettings):
 
     SYSLOG_ADDRESS: str
 
+    SPOTIFY_API_URL: str = "https://api.spotify.com/v1/"
+    SPOTIFY_TOKEN_URL: str = "https://accounts.spotify.com/api/token"
+
+    MAX_IN_FLIGHT: int = 8
+    TOP_SONGS_WORKERS: int = 4  # 'Top Songs' playlists updated at once, 1 = serially
+    RATE_LIMIT: float = 20.0  # requests per second, before any 429
+    ASYNC_CLIENT: bool = False
+    CACHE_PATH: str = ".cache/spotify.sqlite"
+    STATE_PATH: str = ".cache/state.sqlite"
+    CATALOG_PATH: str = (
+        ".cache/catalog.sqlite"  # local mirror, see jobs/sync_catalog.py
+    )
+    TOKEN_PATH: str | None = ".cache/token.json"  # access token shared by the jobs
+    STATE_CHECK_INTERVAL: int = 3000  # seconds, a bit less than an hourly schedule
+
+    METRICS_JSONL: str | None = None  # file receiving a JSON line per API call
+    METRICS_PROMETHEUS_DIR: str | None = None  # node_exporter textfile collector dir
+
+    # other users to run the jobs for, as a JSON list of Account, e.g.
+    # ACCOUNTS='[{"user_id": "...", "refresh_token": "...", "release_radar_id": "..."}]'
+    ACCOUNTS: list[Account] = []
+
+    def accounts(self) -> list[Account]:
+        """The account of USER_ID, then those of ACCOUNTS."""
+        main = Account(
+            user_id=str(self.USER_ID),
+            refresh_token=self.SPOTIFY_REFRESH_TOKEN,
+            release_radar_id=self.RELEASE_RADAR_ID,
+        )
+        others = [x for x in self.ACCOUNTS if x.user_id != main.user_id]
+        return [main] + others
+
 
 settings = Settings()
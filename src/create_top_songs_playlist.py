@@ -1,13 +1,18 @@
-"""Create a Spotify playlist with the top songs of a specific artist."""
+"""Create Spotify playlists with the top songs of some artists."""
 
-import jmespath
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyOAuth
+from __future__ import annotations
+
+import argparse
+from typing import TYPE_CHECKING
 
 from config import settings
+from lib.artist_ids import ArtistIds
 from lib.logger import setup_logger
 from lib.timer import timer
 
+if TYPE_CHECKING:
+    from spotipy import Spotify
+
 ARTIST_NAME = "Asfar Shamsi"
 log = setup_logger("spotify-top-songs")
 
@@ -57,37 +62,21 @@ def get_user_playlists(spotipy: Spotify) -> list:
     return playlists
 
 
-@timer(logger=log)
-def main():
-    # instantiate the class
-    spotipy = Spotify(
-        auth_manager=SpotifyOAuth(
-            client_id=settings.SPOTIPY_CLIENT_ID,
-            client_secret=settings.SPOTIPY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIPY_REDIRECT_URI,
-            scope=settings.SPOTIPY_SCOPE,
-        )
-    )
+def get_artists(spotipy: Spotify, artist_ids: list) -> list:
+    """Get artists details for a list of artist IDs, handling batching."""
+    artists = []
+    batch_size = 50
 
-    # get artist id
-    results = spotipy.search(ARTIST_NAME, type="artist")
-    if not results["artists"]["items"]:
-        log.error("No result found")
-        return
+    for i in range(0, len(artist_ids), batch_size):
+        response = spotipy.artists(artist_ids[i : i + batch_size])
+        artists.extend(response["artists"])
 
-    artist = results["artists"]["items"][0]
-    if artist["name"].lower() != ARTIST_NAME.lower():
-        log.error(f"Artist not found, results: {results}")
-        return
+    return artists
 
-    playlist_name = f"{artist['name']}: Top Songs"
-    playlists = get_user_playlists(spotipy)
-    existing_playlist = next(
-        (pl for pl in playlists if pl["name"] == playlist_name), None
-    )
-    if existing_playlist:
-        log.warning(f"Playlist '{playlist_name}' already exists. Exiting.")
-        return
+
+def create_playlist(spotipy: Spotify, artist: dict, user_id: str) -> dict:
+    """Create the 'Top Songs' playlist of an artist, their songs sorted by popularity."""
+    import jmespath
 
     # get all albums of the artist
     albums = get_artist_albums_all(spotipy, artist["id"])
@@ -103,7 +92,7 @@ def main():
     filtered_tracks = jmespath.search(
         f"[?contains(artists[].id, '{artist['id']}')]", album_tracks
     )
-    log.info(f"Found {len(filtered_tracks)} tracks for artist '{ARTIST_NAME}'")
+    log.info(f"Found {len(filtered_tracks)} tracks for artist '{artist['name']}'")
 
     # get track details to access popularity
     tracks = get_tracks(spotipy, track_ids=[track["id"] for track in filtered_tracks])
@@ -113,8 +102,8 @@ def main():
 
     # create playlist if it doesn't exist
     playlist = spotipy.user_playlist_create(
-        user=spotipy.current_user()["id"],
-        name=playlist_name,
+        user=user_id,
+        name=f"{artist['name']}: Top Songs",
         description=f"Top songs of {artist['name']}, "
         f"ordered by popularity from highest to lowest. "
         f"This playlist is updated every friday at 00:00:00 UTC.",
@@ -122,6 +111,56 @@ def main():
 
     # add songs to the playlist
     spotipy.playlist_add_items(playlist["id"], [track["id"] for track in sorted_tracks])
+    return playlist
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "artists", nargs="*", default=[ARTIST_NAME], help="names of the artists"
+    )
+    return parser.parse_args(argv)
+
+
+@timer(logger=log)
+def main(argv: list[str] = None):
+    from spotipy import Spotify
+    from spotipy.oauth2 import SpotifyOAuth
+
+    args = parse_args(argv)
+
+    # instantiate the class
+    spotipy = Spotify(
+        auth_manager=SpotifyOAuth(
+            client_id=settings.SPOTIPY_CLIENT_ID,
+            client_secret=settings.SPOTIPY_CLIENT_SECRET,
+            redirect_uri=settings.SPOTIPY_REDIRECT_URI,
+            scope=settings.SPOTIPY_SCOPE,
+        )
+    )
+
+    # get artists ids, all at once: the names already resolved aren't searched again
+    artist_ids = ArtistIds(settings.STATE_PATH)
+    ids = artist_ids.resolve(
+        args.artists,
+        lambda name: spotipy.search(name, type="artist")["artists"]["items"],
+    )
+    for name in args.artists:
+        if name not in ids:
+            log.error(f"No artist found with the name '{name}'")
+
+    playlists = get_user_playlists(spotipy)
+    names = {playlist["name"] for playlist in playlists}
+    user_id = spotipy.current_user()["id"]
+    for artist in get_artists(spotipy, list(dict.fromkeys(ids.values()))):
+        playlist_name = f"{artist['name']}: Top Songs"
+        if playlist_name in names:
+            log.warning(f"Playlist '{playlist_name}' already exists. Skipping.")
+            continue
+        playlist = create_playlist(spotipy, artist, user_id)
+
+        # update_top_songs won't have to search the artist of the playlist
+        artist_ids.pin(playlist["id"], artist["name"], artist["id"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+"""Setup shared by the jobs: API clients built from the settings and end-of-run report."""
+
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from config import Account, settings
+from lib.artist_ids import ArtistIds
+from lib.cache import ResponseCache
+from lib.client import Spotify
+from lib.metrics import Histogram, JsonLinesSink, Metrics, PrometheusTextfile
+from lib.ratelimit import RateLimiter
+from lib.state import ReleaseState
+
+if TYPE_CHECKING:
+    from lib.async_client import AsyncSpotify
+
+
+def create_metrics(job: str) -> Metrics:
+    """In-memory histogram, plus the JSON lines / Prometheus sinks enabled in the settings."""
+    sinks = [Histogram()]
+    if settings.METRICS_JSONL:
+        sinks.append(JsonLinesSink(settings.METRICS_JSONL))
+    if settings.METRICS_PROMETHEUS_DIR:
+        path = Path(settings.METRICS_PROMETHEUS_DIR) / f"spotify_{job}.prom"
+        sinks.append(PrometheusTextfile(path.as_posix(), job=job))
+    return Metrics(*sinks)
+
+
+def create_client(job: str, account: Account = None, shared: Spotify = None) -> Spotify:
+    """Client of 'account' (default: the USER_ID one).
+    With 'shared', the client of another account, it uses the same connection pool, rate
+    limiter, response cache, metrics and known artists: the catalog is fetched once for all."""
+    return Spotify(
+        **_client_kwargs(job, account, shared),
+        session=shared.session if shared is not None else None,
+    )
+
+
+def create_async_client(
+    job: str, account: Account = None, shared: AsyncSpotify = None
+) -> AsyncSpotify:
+    """See create_client, only the client owning the connection pool (shared=None) closes it."""
+    from lib.async_client import AsyncSpotify  # httpx is only needed with ASYNC_CLIENT
+
+    return AsyncSpotify(
+        **_client_kwargs(job, account, shared),
+        client=shared.client if shared is not None else None,
+    )
+
+
+def _client_kwargs(job: str, account: Account = None, shared=None) -> dict:
+    account = account or settings.accounts()[0]
+    kwargs = {
+        "user_id": account.user_id,
+        "refresh_token": account.refresh_token,
+        "base64": settings.SPOTIFY_CLIENT_BASE_64,
+        "base_url": settings.SPOTIFY_API_URL,
+        "token_url": settings.SPOTIFY_TOKEN_URL,
+        "token_path": settings.TOKEN_PATH,
+    }
+    if shared is None:
+        kwargs["cache"] = ResponseCache(settings.CACHE_PATH)
+        kwargs["rate_limiter"] = RateLimiter(settings.RATE_LIMIT)
+        kwargs["metrics"] = create_metrics(job)
+        kwargs["artist_ids"] = ArtistIds(settings.STATE_PATH)
+    else:
+        kwargs["cache"] = shared.cache
+        kwargs["rate_limiter"] = shared.rate_limiter
+        kwargs["metrics"] = shared.metrics
+        kwargs["artists"] = shared.artists.fork()
+        kwargs["artist_ids"] = shared.artist_ids
+    return kwargs
+
+
+def create_state(job: str, account: Account) -> ReleaseState:
+    """What 'job' already processed for 'account' (USER_ID's keeps the job's own state)."""
+    if account.user_id != str(settings.USER_ID):
+        job = f"{job}/{account.user_id}"
+    return ReleaseState(job, settings.STATE_PATH)
+
+
+def run_accounts(
+    logger: logging.Logger, job: str, run: Callable[[Spotify, Account], None]
+) -> None:
+    """Call 'run(spotify, account)' for every account (see settings.accounts), one after the
+    other, over clients sharing the first one's connection pool, rate limiter, response cache
+    and metrics, then report (even if it failed). An account failing doesn't stop the others."""
+    accounts = settings.accounts()
+    owner = create_client(job, accounts[0])
+    failed = []
+    try:
+        for i, account in enumerate(accounts):
+            spotify = create_client(job, account, shared=owner) if i else owner
+            if len(accounts) > 1:
+                logger.info(f"Running {job} for {account.label} ...")
+            try:
+                run(spotify, account)
+            except Exception:
+                if len(accounts) == 1:
+                    raise
+                logger.exception(f"{job} failed for {account.label}")
+                failed.append(account.label)
+    finally:
+        report(logger, owner)
+    if failed:
+        raise Exception(f"{job} failed for: {', '.join(failed)}")
+
+
+async def run_accounts_async(
+    logger: logging.Logger,
+    job: str,
+    run: Callable[[AsyncSpotify, Account], Awaitable[None]],
+) -> None:
+    """Same as 'run_accounts' with AsyncSpotify clients."""
+    accounts = settings.accounts()
+    failed = []
+    async with create_async_client(job, accounts[0]) as owner:
+        try:
+            for i, account in enumerate(accounts):
+                spotify = (
+                    create_async_client(job, account, shared=owner) if i else owner
+                )
+                if len(accounts) > 1:
+                    logger.info(f"Running {job} for {account.label} ...")
+                try:
+                    await run(spotify, account)
+                except Exception:
+                    if len(accounts) == 1:
+                        raise
+                    logger.exception(f"{job} failed for {account.label}")
+                    failed.append(account.label)
+        finally:
+            report(logger, owner)
+    if failed:
+        raise Exception(f"{job} failed for: {', '.join(failed)}")
+
+
+def report(logger: logging.Logger, spotify: Spotify | AsyncSpotify) -> None:
+    """Log the cache, rate limiter and connection stats and the per-endpoint latencies,
+    then flush the metrics sinks."""
+    logger.info(f"Cache stats: {spotify.cache.stats()}")
+    logger.info(f"Rate limiter: {spotify.rate_limiter.stats()}")
+    logger.info(f"Connections: {spotify.connection_stats()}")
+    logger.info(f"API calls:\n{spotify.metrics.table()}")
+    spotify.metrics.close()
@@ -1,84 +1,198 @@
 """Like new album(s) from my favorite artists"""
 
+from __future__ import annotations
+
+import asyncio
 import sys
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-
-import pandas as pd
+from typing import TYPE_CHECKING
 
 ROOT_DIR = Path(__file__).resolve().parents[1].as_posix()
 sys.path.append(ROOT_DIR)
 
 from config import settings  # noqa: E402
-from lib.client import Spotify  # noqa: E402
+from jobs.common import create_state, run_accounts, run_accounts_async  # noqa: E402
+from lib.concurrency import afan_out, fan_out  # noqa: E402
 from lib.logger import setup_logger  # noqa: E402
+from lib.state import ReleaseState  # noqa: E402
 from lib.timer import timer  # noqa: E402
 
+if TYPE_CHECKING:
+    from lib.async_client import AsyncSpotify
+    from lib.client import Spotify
+    from lib.models import Artist
+
 LOGGER = setup_logger("spotify-routines")
-END_DATE = pd.Timestamp.utcnow().date()
-START_DATE = END_DATE - pd.Timedelta(days=6)
+END_DATE = datetime.now(timezone.utc).date()
+START_DATE = END_DATE - timedelta(days=6)
+NO_NEW_ALBUMS = "No new albums from your favorite artists"
+# same listing as update_release_radar (albums are kept afterwards): both share its cached pages
+RELEASES_INCLUDE = "album,single,appears_on"
+
+
+def _new_album_ids(
+    artist_id: str, artist_albums: list[dict], state: ReleaseState
+) -> list[str]:
+    """Ids of the albums not handled by a previous run, staged in 'state'."""
+    unseen = set(state.unseen([album["id"] for album in artist_albums]))
+    new = [album for album in artist_albums if album["id"] in unseen]
+    state.checked(artist_id, [(album["id"], album["release_date"]) for album in new])
+    return [album["id"] for album in new]
+
+
+def _due_artists(artists: list[Artist], state: ReleaseState) -> list[Artist]:
+    """Followed artists whose albums weren't checked recently."""
+    due = set(
+        state.due([artist.id for artist in artists], settings.STATE_CHECK_INTERVAL)
+    )
+    return [artist for artist in artists if artist.id in due]
+
+
+def _unique_albums(
+    new: list[tuple[str, str]], albums_objects: list[dict | None]
+) -> dict[str, str]:
+    """Id -> name of the 'new' (artist name, album id) albums, one per artist and album name.
+    'albums_objects' are their album objects, None for the ones no longer available."""
+    albums, seen = {}, set()
+    for (artist_name, album_id), album in zip(new, albums_objects):
+        if album is None:
+            continue
+        album_name = album["name"]
+        if (artist_name, album_name) not in seen:
+            seen.add((artist_name, album_name))
+            albums.setdefault(album_id, album_name)
+    return albums
 
 
 @timer(LOGGER)
 def main():
-    # instantiate class
-    spotify = Spotify(
-        user_id=settings.USER_ID,
-        refresh_token=settings.SPOTIFY_REFRESH_TOKEN,
-        base64=settings.SPOTIFY_CLIENT_BASE_64,
+    if settings.ASYNC_CLIENT:
+        return asyncio.run(main_async())
+
+    # for every account, their clients sharing the catalog cache
+    run_accounts(
+        LOGGER,
+        "like_new_albums",
+        lambda spotify, account: run(spotify, create_state("like_new_albums", account)),
     )
 
-    # get artists I follow
+
+def run(spotify: Spotify, state: ReleaseState):
+    # get artists I follow, only those not checked recently
     LOGGER.info("Getting favorite artists...")
-    df = pd.DataFrame()
-    df["artist_id"] = spotify.get_favorite_artists()
-    df["artist_name"] = df["artist_id"].apply(spotify.get_artist_name)
-    LOGGER.info(f"Found {df.shape[0]} fav. artists.")
+    artists = spotify.get_favorite_artists(return_="record")
+    due = _due_artists(artists, state)
+    LOGGER.info(f"Found {len(artists)} fav. artists, {len(due)} to check.")
 
-    # get albums from those artists
+    # get albums from those artists, newer than what previous runs saw
     LOGGER.info("Getting new albums from those artists...")
-    album_ids = []
-    for artist_id in df["artist_id"]:
-        artist_albums = spotify.get_artist_releases(
-            artist_id, start_date=START_DATE, end_date=END_DATE, include="album"
+
+    def get_new_album_ids(artist_id: str) -> list[str]:
+        artist_albums = spotify.iter_artist_releases(
+            artist_id,
+            start_date=state.since(artist_id, START_DATE),
+            end_date=END_DATE,
+            include=RELEASES_INCLUDE,
         )
-        if "id" not in artist_albums.columns:
-            album_ids.append([])
-        else:
-            album_ids.append(artist_albums["id"].to_list())
-    df["album_id"] = album_ids
-    df = df.explode("album_id").dropna(subset="album_id")
-
-    if df.empty:
-        msg = "No new albums from your favorite artists"
-        LOGGER.info(msg)
+        albums = [x for x in artist_albums if x["album_group"] == "album"]
+        return _new_album_ids(artist_id, albums, state)
+
+    album_ids = fan_out(
+        get_new_album_ids,
+        [artist.id for artist in due],
+        max_workers=settings.MAX_IN_FLIGHT,
+        default=[],
+        logger=LOGGER,
+    )
+    new = [(a.name, album_id) for a, ids in zip(due, album_ids) for album_id in ids]
+    albums = _unique_albums(new, spotify.get_albums([x[1] for x in new]))
+
+    if not albums:
+        LOGGER.info(NO_NEW_ALBUMS)
+        state.commit()
         # send_email(
         #     sender=settings.GMAIL_ADDRESS,
         #     receipient=settings.GMAIL_ADDRESS,
-        #     subject=msg,
+        #     subject=NO_NEW_ALBUMS,
         # )
         return
 
-    df["album_name"] = df["album_id"].apply(lambda x: spotify.get_album(x)["name"])
-    df.drop_duplicates(subset=["artist_name", "album_name"], inplace=True)
-    n_albums = len(df["album_id"].unique())
-    LOGGER.info(f"Found {n_albums} new album(s) ({df['album_name'].tolist()})")
+    n_albums = len(albums)
+    LOGGER.info(f"Found {n_albums} new album(s) ({list(albums.values())})")
 
     # like those albums
-    r = spotify.save_albums(ids=df["album_id"].to_list())
+    r = spotify.save_albums(ids=list(albums))
     if not r.ok:
         LOGGER.error(f"Error while saving albums: {r.text}")
         return
     LOGGER.info(f"{n_albums} new album(s) liked")
+    state.commit()
+    state.prune(START_DATE)
 
     # send email
     # send_email(
     #     subject=f"{n_albums} new albums found from your favorite artists!",
-    #     html=df.to_html(
-    #         columns=["artist_name", "album_name"], bold_rows=True, index=False
-    #     ),
+    #     html="<br>".join(albums.values()),
     # )
     # LOGGER.info(f"Mail sent.")
 
 
+async def main_async():
+    await run_accounts_async(
+        LOGGER,
+        "like_new_albums",
+        lambda spotify, account: run_async(
+            spotify, create_state("like_new_albums", account)
+        ),
+    )
+
+
+async def run_async(spotify: AsyncSpotify, state: ReleaseState):
+    """Same as 'run' but on top of the asyncio client."""
+    LOGGER.info("Getting favorite artists...")
+    artists = await spotify.get_favorite_artists(return_="record")
+    due = _due_artists(artists, state)
+    LOGGER.info(f"Found {len(artists)} fav. artists, {len(due)} to check.")
+
+    LOGGER.info("Getting new albums from those artists...")
+
+    async def get_new_album_ids(artist_id: str) -> list[str]:
+        artist_albums = spotify.iter_artist_releases(
+            artist_id,
+            start_date=state.since(artist_id, START_DATE),
+            end_date=END_DATE,
+            include=RELEASES_INCLUDE,
+        )
+        albums = [x async for x in artist_albums if x["album_group"] == "album"]
+        return _new_album_ids(artist_id, albums, state)
+
+    album_ids = await afan_out(
+        get_new_album_ids,
+        [artist.id for artist in due],
+        max_in_flight=settings.MAX_IN_FLIGHT,
+        default=[],
+        logger=LOGGER,
+    )
+    new = [(a.name, album_id) for a, ids in zip(due, album_ids) for album_id in ids]
+    albums = _unique_albums(new, await spotify.get_albums([x[1] for x in new]))
+
+    if not albums:
+        LOGGER.info(NO_NEW_ALBUMS)
+        state.commit()
+        return
+
+    n_albums = len(albums)
+    LOGGER.info(f"Found {n_albums} new album(s) ({list(albums.values())})")
+
+    r = await spotify.save_albums(ids=list(albums))
+    if not r.is_success:
+        LOGGER.error(f"Error while saving albums: {r.text}")
+        return
+    LOGGER.info(f"{n_albums} new album(s) liked")
+    state.commit()
+    state.prune(START_DATE)
+
+
 if __name__ == "__main__":
     main()
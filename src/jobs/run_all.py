@@ -0,0 +1,142 @@
+"""Run the three routines in one process, sharing one client (token, connection pool,
+rate limiter, response cache and artist index) so that what they have in common
+(followed artists, artists' releases, albums' tracks) is only fetched once.
+With several accounts, they run for each one in turn, the catalog being shared too."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1].as_posix()
+sys.path.append(ROOT_DIR)
+
+from config import Account, settings  # noqa: E402
+from jobs import like_new_albums, update_release_radar, update_top_songs  # noqa: E402
+from jobs.common import create_state, run_accounts, run_accounts_async  # noqa: E402
+from lib.logger import setup_logger  # noqa: E402
+from lib.timer import timer  # noqa: E402
+
+LOGGER = setup_logger("spotify-routines")
+
+
+def _jobs() -> dict:
+    """Name -> run(spotify, account) of each routine, in the order they run."""
+
+    def top_songs(spotify, account) -> None:
+        results = update_top_songs.run(spotify, workers=settings.TOP_SONGS_WORKERS)
+        update_top_songs.summary(results)
+
+    return {
+        "like_new_albums": lambda spotify, account: like_new_albums.run(
+            spotify, create_state("like_new_albums", account)
+        ),
+        "update_release_radar": lambda spotify, account: update_release_radar.run(
+            spotify,
+            create_state("update_release_radar", account),
+            account.release_radar_id,
+        ),
+        "update_top_songs": top_songs,
+    }
+
+
+def _async_jobs() -> dict:
+    """Same as '_jobs', with the routines' coroutines."""
+
+    async def top_songs(spotify, account) -> None:
+        results = await update_top_songs.run_async(
+            spotify, workers=settings.TOP_SONGS_WORKERS
+        )
+        update_top_songs.summary(results)
+
+    return {
+        "like_new_albums": lambda spotify, account: like_new_albums.run_async(
+            spotify, create_state("like_new_albums", account)
+        ),
+        "update_release_radar": lambda spotify, account: update_release_radar.run_async(
+            spotify,
+            create_state("update_release_radar", account),
+            account.release_radar_id,
+        ),
+        "update_top_songs": top_songs,
+    }
+
+
+def _label(job: str, account: Account) -> str:
+    return job if len(settings.accounts()) == 1 else f"{account.label}/{job}"
+
+
+def _log_summary(timings: list[dict]) -> None:
+    width = max(22, *(len(timing["job"]) + 2 for timing in timings))
+    lines = [f"{'job':<{width}}{'status':>8}{'requests':>10}{'seconds':>9}"]
+    for timing in timings:
+        lines.append(
+            f"{timing['job']:<{width}}{timing['status']:>8}"
+            f"{timing['requests']:>10}{timing['seconds']:>9.2f}"
+        )
+    LOGGER.info("Jobs:\n" + "\n".join(lines))
+    failed = [timing["job"] for timing in timings if timing["status"] != "ok"]
+    if failed:
+        raise Exception(f"Failed jobs: {', '.join(failed)}")
+
+
+@timer(LOGGER)
+def main() -> None:
+    LOGGER.info("Script is running")
+    if settings.ASYNC_CLIENT:
+        return asyncio.run(main_async())
+
+    timings = []
+
+    def run_jobs(spotify, account: Account) -> None:
+        for job, run in _jobs().items():
+            LOGGER.info(f"Running {job} ...")
+            requests, t0 = spotify.metrics.requests, time.perf_counter()
+            status = "ok"
+            try:
+                run(spotify, account)
+            except Exception:
+                LOGGER.exception(f"{job} failed")
+                status = "failed"
+            timings.append(
+                {
+                    "job": _label(job, account),
+                    "status": status,
+                    "requests": spotify.metrics.requests - requests,
+                    "seconds": time.perf_counter() - t0,
+                }
+            )
+
+    # one client per account, all sharing the catalog cache
+    run_accounts(LOGGER, "run_all", run_jobs)
+    _log_summary(timings)
+
+
+async def main_async() -> None:
+    timings = []
+
+    async def run_jobs(spotify, account: Account) -> None:
+        for job, run in _async_jobs().items():
+            LOGGER.info(f"Running {job} ...")
+            requests, t0 = spotify.metrics.requests, time.perf_counter()
+            status = "ok"
+            try:
+                await run(spotify, account)
+            except Exception:
+                LOGGER.exception(f"{job} failed")
+                status = "failed"
+            timings.append(
+                {
+                    "job": _label(job, account),
+                    "status": status,
+                    "requests": spotify.metrics.requests - requests,
+                    "seconds": time.perf_counter() - t0,
+                }
+            )
+
+    await run_accounts_async(LOGGER, "run_all", run_jobs)
+    _log_summary(timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Mirror the discographies of my favorite artists in CATALOG_PATH, to query them offline"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+ROOT_DIR = Path(__file__).resolve().parents[1].as_posix()
+sys.path.append(ROOT_DIR)
+
+from config import settings  # noqa: E402
+from jobs.common import run_accounts  # noqa: E402
+from lib.logger import setup_logger  # noqa: E402
+from lib.mirror import CatalogMirror  # noqa: E402
+from lib.timer import timer  # noqa: E402
+
+if TYPE_CHECKING:
+    from lib.client import Spotify
+
+LOGGER = setup_logger("spotify-routines")
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="list whole discographies, dropping the albums no longer in them",
+    )
+    parser.add_argument(
+        "--popularity-days",
+        type=float,
+        default=7,
+        help="age after which the popularity of tracks is refreshed",
+    )
+    return parser.parse_args(argv)
+
+
+@timer(LOGGER)
+def main(argv: list[str] = None) -> None:
+    LOGGER.info("Script is running")
+    args = parse_args(argv)
+    mirror = CatalogMirror(settings.CATALOG_PATH)
+
+    # the artists followed by every account, those already synced being skipped
+    run_accounts(
+        LOGGER,
+        "sync_catalog",
+        lambda spotify, account: run(
+            spotify, mirror, full=args.full, popularity_days=args.popularity_days
+        ),
+    )
+    LOGGER.info(f"Mirror: {mirror.stats()}")
+
+
+def run(
+    spotify: Spotify,
+    mirror: CatalogMirror,
+    full: bool = False,
+    popularity_days: float = 7,
+) -> dict:
+    LOGGER.info("Getting favorite artists...")
+    artist_ids = spotify.get_favorite_artists()
+    LOGGER.info(f"Syncing the discographies of {len(artist_ids)} artists...")
+    changes = mirror.sync(
+        spotify,
+        artist_ids,
+        full=full,
+        popularity_age=popularity_days * 24 * 3600,
+        max_workers=settings.MAX_IN_FLIGHT,
+        logger=LOGGER,
+    )
+    LOGGER.info(f"Changes: {changes}")
+    return changes
+
+
+if __name__ == "__main__":
+    main()
@@ -1,96 +1,237 @@
 """Get new songs from my favorite artists and update custom 'Release Radar' playlist"""
 
+from __future__ import annotations
+
+import asyncio
+import re
 import sys
+from datetime import date, datetime, timedelta, timezone
+from itertools import chain
 from pathlib import Path
-
-import pandas as pd
+from typing import TYPE_CHECKING, Iterable
 
 ROOT_DIR = Path(__file__).resolve().parents[1].as_posix()
 sys.path.append(ROOT_DIR)
 
 from config import settings  # noqa: E402
-from lib.client import Spotify  # noqa: E402
+from jobs.common import create_state, run_accounts, run_accounts_async  # noqa: E402
+from lib.concurrency import afan_out, fan_out  # noqa: E402
 from lib.logger import setup_logger  # noqa: E402
+from lib.models import TrackIndex  # noqa: E402
+from lib.releases import (  # noqa: E402
+    RADAR_FIELDS,
+    afetch_tracks,
+    albums_not_in_radar,
+    fetch_tracks,
+    release_record,
+    track_record,
+    tracks_uris,
+)
+from lib.state import ReleaseState  # noqa: E402
 from lib.timer import timer  # noqa: E402
 
+if TYPE_CHECKING:
+    from lib.async_client import AsyncSpotify
+    from lib.client import Spotify
+
 LOGGER = setup_logger("spotify-routines")
-END_DATE = pd.Timestamp.utcnow().date()
-START_DATE = END_DATE - pd.Timedelta(days=6)
+END_DATE = datetime.now(timezone.utc).date()
+START_DATE = END_DATE - timedelta(days=6)
+RELEASE_RADAR = re.compile(r"Release Radar \(\S+\s\d+\)")
+
+
+def _get_release_radar_id(my_playlists: Iterable[dict]) -> str:
+    """Find the id of the custom 'Release Radar (<date>)' playlist."""
+    ids = [x["id"] for x in my_playlists if RELEASE_RADAR.search(x["name"])]
+    if len(ids) > 1:
+        raise Exception(
+            "There a more than 1 custom Release Radar playlists! Need only one."
+        )
+    elif len(ids) == 0:
+        raise Exception("No already existing custom Release Radar playlists! Need one.")
+    return ids[0]
+
+
+def _new_releases(
+    artist_id: str, releases: Iterable[dict], state: ReleaseState
+) -> list[dict]:
+    """Releases not handled by a previous run, staged in 'state'."""
+    releases = [release_record(x) for x in releases]
+    unseen = set(state.unseen([x["id"] for x in releases]))
+    releases = [x for x in releases if x["id"] in unseen]
+    state.checked(artist_id, [(x["id"], x["release_date"]) for x in releases])
+    return releases
+
+
+def _new_week(state: ReleaseState) -> bool:
+    """Whether the playlist was last reset more than 6 days ago (or never)."""
+    reset = state.get("playlist_reset")
+    return reset is None or date.fromisoformat(reset) < START_DATE
 
 
 @timer(LOGGER)
 def main():
-    # instantiate class
-    spotify = Spotify(
-        user_id=settings.USER_ID,
-        refresh_token=settings.SPOTIFY_REFRESH_TOKEN,
-        base64=settings.SPOTIFY_CLIENT_BASE_64,
+    if settings.ASYNC_CLIENT:
+        return asyncio.run(main_async())
+
+    # for every account, their clients sharing the catalog cache
+    run_accounts(
+        LOGGER,
+        "update_release_radar",
+        lambda spotify, account: run(
+            spotify,
+            create_state("update_release_radar", account),
+            account.release_radar_id,
+        ),
     )
 
+
+def run(spotify: Spotify, state: ReleaseState, release_radar_id: str = None):
+    """:release_radar_id: the user's Spotify 'Release Radar' (default: RELEASE_RADAR_ID)"""
     # first get previous playlist id
-    my_playlists = spotify.get_user_playlists()
-    my_playlists["cus_release_radar"] = my_playlists["name"].str.contains(
-        r"Release Radar \(\S+\s\d+\)", regex=True
-    )
-    if my_playlists["cus_release_radar"].sum() > 1:
-        raise Exception(
-            "There a more than 1 custom Release Radar playlists! Need only one."
+    playlist_id = _get_release_radar_id(spotify.iter_user_playlists())
+
+    # get artists I follow, only those not checked recently
+    LOGGER.info("Getting favorite artists ...")
+    artists = spotify.get_favorite_artists(return_="record")
+    due = state.due([artist.id for artist in artists], settings.STATE_CHECK_INTERVAL)
+    LOGGER.info(f"Found {len(artists)} fav. artists, {len(due)} to check.")
+
+    # get new releases from those artists, newer than what previous runs saw
+    LOGGER.info("Getting new albums from those artists ...")
+
+    def get_new_releases(artist_id: str) -> list[dict]:
+        releases = spotify.iter_artist_releases(
+            artist_id, start_date=state.since(artist_id, START_DATE), end_date=END_DATE
         )
-    elif my_playlists["cus_release_radar"].sum() == 0:
-        raise Exception("No already existing custom Release Radar playlists! Need one.")
-    playlist_id = my_playlists.query("cus_release_radar == True")["id"].iloc[0]
+        return _new_releases(artist_id, releases, state)
+
+    new_albums = chain.from_iterable(
+        fan_out(
+            get_new_releases,
+            due,
+            max_workers=settings.MAX_IN_FLIGHT,
+            default=[],
+            logger=LOGGER,
+        )
+    )
+
+    # get songs from release radar to not add them (nor other versions of them)
+    LOGGER.info("Getting songs from release radar ...")
+    radar = TrackIndex(
+        [
+            track_record(track)
+            for track in spotify.iter_playlist_items(
+                release_radar_id or settings.RELEASE_RADAR_ID, fields=RADAR_FIELDS
+            )
+        ]
+    )
+
+    # songs that are in new_releases but not in the radar
+    album_ids = albums_not_in_radar(new_albums, radar)
+
+    # get the albums' tracks, 20 albums then 50 tracks (for their ISRC) per request
+    tracks = fetch_tracks(
+        spotify, album_ids, max_workers=settings.MAX_IN_FLIGHT, logger=LOGGER
+    )
+    artists_names = [artist.name for artist in artists]
+    uris = list(tracks_uris(tracks, artists_names, radar))
+
+    # each write is followed by its commit: a crash later on must not replay it
+    if _new_week(state):
+        # update playlist description
+        LOGGER.info("Updating playlist ...")
+        playlist_name = f"Release Radar ({END_DATE.strftime('%b %d')})"
+        spotify.change_playlist_details(playlist_id, name=playlist_name)
+
+        # replace last week's songs with the new ones
+        LOGGER.info(f"Add songs to to playlist {playlist_name} ...")
+        spotify.update_playlist_items(playlist_id, uris)
+        state.set("playlist_reset", END_DATE.isoformat())
+        state.commit()
+    elif uris:
+        # same week: add the songs released since the last run on top
+        LOGGER.info(f"Add {len(uris)} songs to the playlist ...")
+        spotify.add_to_playlist(playlist_id, uris)
+        state.commit()
+    else:
+        LOGGER.info("No new songs since the last run.")
+        state.commit()
+    state.prune(START_DATE)
+
+
+async def main_async():
+    await run_accounts_async(
+        LOGGER,
+        "update_release_radar",
+        lambda spotify, account: run_async(
+            spotify,
+            create_state("update_release_radar", account),
+            account.release_radar_id,
+        ),
+    )
+
+
+async def run_async(
+    spotify: AsyncSpotify, state: ReleaseState, release_radar_id: str = None
+):
+    """Same as 'run' but on top of the asyncio client."""
+    my_playlists = [x async for x in spotify.iter_user_playlists()]
+    playlist_id = _get_release_radar_id(my_playlists)
 
-    # get artists I follow
     LOGGER.info("Getting favorite artists ...")
-    artists = spotify.get_favorite_artists()
-    LOGGER.info(f"Found {len(artists)} fav. artists.")
+    artists = await spotify.get_favorite_artists(return_="record")
+    due = state.due([artist.id for artist in artists], settings.STATE_CHECK_INTERVAL)
+    LOGGER.info(f"Found {len(artists)} fav. artists, {len(due)} to check.")
 
-    # get new releases from those artists
     LOGGER.info("Getting new albums from those artists ...")
-    new_albums = pd.DataFrame()
-    for artist_id in artists:
-        # for artist_id in ['3TVXtAsR1Inumwj472S9r4']:  # debug
-        new_albums = pd.concat(
-            [
-                new_albums,
-                spotify.get_artist_releases(
-                    artist_id, start_date=START_DATE, end_date=END_DATE
-                )[["id", "name"]],
-            ],
-            ignore_index=True,
+
+    async def get_new_releases(artist_id: str) -> list[dict]:
+        releases = spotify.iter_artist_releases(
+            artist_id, start_date=state.since(artist_id, START_DATE), end_date=END_DATE
+        )
+        return _new_releases(artist_id, [x async for x in releases], state)
+
+    new_albums = chain.from_iterable(
+        await afan_out(
+            get_new_releases,
+            due,
+            max_in_flight=settings.MAX_IN_FLIGHT,
+            default=[],
+            logger=LOGGER,
         )
+    )
 
-    # get songs from release radar to not add them
     LOGGER.info("Getting songs from release radar ...")
-    radar_albums = spotify.get_songs_from_playlist(settings.RELEASE_RADAR_ID)[
-        ["id", "name"]
-    ]
-
-    # songs that are in new_releases but not in radar_albums
-    merge = new_albums.merge(radar_albums, on="name", how="left", indicator=True)
-    merge = merge.query("_merge == 'left_only'").drop_duplicates(
-        subset=["name"], keep="first"
+    items = spotify.iter_playlist_items(
+        release_radar_id or settings.RELEASE_RADAR_ID, fields=RADAR_FIELDS
     )
+    radar = TrackIndex([track_record(track) async for track in items])
+    album_ids = albums_not_in_radar(new_albums, radar)
 
-    # get tracks uris from albums
-    tracks = pd.DataFrame()
-    for album in merge["id_x"].to_list():
-        tracks = pd.concat([tracks, spotify.get_tracks_from_album(album)])
-    tracks.drop_duplicates("name", keep="first", inplace=True)  # remove non explicit
-    tracks = tracks.explode("artists")
-    tracks["artist_name"] = [x["name"] for x in tracks["artists"]]
-    artists_names = [spotify.get_artist_name(id_) for id_ in artists]
-    tracks = tracks.query(f"artist_name.isin({artists_names})").drop_duplicates("uri")
-    tracks_uris = tracks["uri"].to_list()
-
-    # update playlist description
-    LOGGER.info("Updating playlist ...")
-    playlist_name = f"Release Radar ({END_DATE.strftime('%b %d')})"
-    spotify.change_playlist_details(playlist_id, name=playlist_name)
-
-    # update playlist with new songs
-    LOGGER.info(f"Add songs to to playlist {playlist_name} ...")
-    spotify.update_playlist_items(playlist_id, tracks_uris)
+    tracks = await afetch_tracks(
+        spotify, album_ids, max_in_flight=settings.MAX_IN_FLIGHT, logger=LOGGER
+    )
+    artists_names = [artist.name for artist in artists]
+    uris = list(tracks_uris(tracks, artists_names, radar))
+
+    if _new_week(state):
+        LOGGER.info("Updating playlist ...")
+        playlist_name = f"Release Radar ({END_DATE.strftime('%b %d')})"
+        await spotify.change_playlist_details(playlist_id, name=playlist_name)
+
+        LOGGER.info(f"Add songs to to playlist {playlist_name} ...")
+        await spotify.update_playlist_items(playlist_id, uris)
+        state.set("playlist_reset", END_DATE.isoformat())
+        state.commit()
+    elif uris:
+        LOGGER.info(f"Add {len(uris)} songs to the playlist ...")
+        await spotify.add_to_playlist(playlist_id, uris)
+        state.commit()
+    else:
+        LOGGER.info("No new songs since the last run.")
+        state.commit()
+    state.prune(START_DATE)
 
 
 if __name__ == "__main__":
@@ -1,63 +1,253 @@
 """Update exisiting 'Top songs' playlists"""
 
+from __future__ import annotations
+
+import argparse
+import asyncio
 import sys
+import time
+import zlib
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 ROOT_DIR = Path(__file__).resolve().parents[1].as_posix()
 sys.path.append(ROOT_DIR)
 
 from config import settings  # noqa: E402
-from lib.client import Spotify  # noqa: E402
+from jobs.common import run_accounts, run_accounts_async  # noqa: E402
+from lib.concurrency import afan_out, fan_out  # noqa: E402
 from lib.logger import setup_logger  # noqa: E402
 from lib.timer import timer  # noqa: E402
 
+if TYPE_CHECKING:
+    from lib.async_client import AsyncSpotify
+    from lib.client import Spotify
+
 LOGGER = setup_logger("spotify-routines")
 
 
+@dataclass(slots=True)
+class PlaylistResult:
+    """Outcome of the refresh of one 'Top Songs' playlist."""
+
+    playlist_id: str
+    artist_name: str
+    tracks: int = 0
+    writes: int = 0  # playlist write requests, 0 if it was up to date
+    seconds: float = 0.0
+    error: str | None = None
+
+
 def update_one_playlist(spotify: Spotify, playlist_id: str, artist_name: str):
-    # get artist id
-    artist_id = spotify.get_artist_id(name=artist_name)
+    # get artist id, only searched the first time
+    artist_id = spotify.get_playlist_artist_id(playlist_id, artist_name)
 
     # get artist's top albums/songs
     songs_uri = spotify.get_artist_top_songs(
         artist_id, include="single,album,appears_on"
     )
 
-    # update existing songs' playlist
-    spotify.update_playlist(playlist_id, uris=songs_uri)
+    # update existing songs' playlist, only where it differs
+    writes = spotify.sync_playlist(playlist_id, songs_uri)
 
     # update playlist's details
-    desc = (
+    if writes:
+        spotify.change_playlist_details(
+            playlist_id, description=_description(artist_name)
+        )
+
+    return len(songs_uri), writes
+
+
+async def update_one_playlist_async(
+    spotify: AsyncSpotify, playlist_id: str, artist_name: str
+):
+    artist_id = await spotify.get_playlist_artist_id(playlist_id, artist_name)
+    songs_uri = await spotify.get_artist_top_songs(
+        artist_id, include="single,album,appears_on"
+    )
+    writes = await spotify.sync_playlist(playlist_id, songs_uri)
+    if writes:
+        await spotify.change_playlist_details(
+            playlist_id, description=_description(artist_name)
+        )
+    return len(songs_uri), writes
+
+
+def _description(artist_name: str) -> str:
+    return (
         f"Top songs of {artist_name}, "
         "ordered by popularity from highest to lowest. "
         f"Last update: {datetime.now().strftime('%Y-%m-%d')}"
     )
-    spotify.change_playlist_details(playlist_id, description=desc)
 
-    return artist_name
+
+def _top_songs_playlists(items: list[dict]) -> list[tuple[str, str]]:
+    """(playlist id, artist name) of the '<artist>: Top Songs' playlists."""
+    return [(x["id"], x["name"].split(":")[0]) for x in items]
+
+
+def _selected(
+    playlists: list[tuple[str, str]],
+    only: list[str] = None,
+    shard: tuple[int, int] = None,
+) -> list[tuple[str, str]]:
+    """Playlists matching one of the 'only' artist names / playlist ids (case-insensitive),
+    and belonging to 'shard' (i, n): playlists are split in n stable groups by id."""
+    if only:
+        wanted = {x.lower() for x in only}
+        playlists = [
+            (id_, artist)
+            for id_, artist in playlists
+            if artist.lower() in wanted or id_.lower() in wanted
+        ]
+    if shard:
+        i, n = shard
+        playlists = [x for x in playlists if zlib.crc32(x[0].encode()) % n == i - 1]
+    return playlists
+
+
+def _log_result(result: PlaylistResult) -> None:
+    if result.error is None and result.writes == 0:
+        LOGGER.info(
+            f"{result.artist_name} 'Top Songs' playlist already up to date "
+            f"({result.tracks} tracks, {result.seconds:.1f}s)"
+        )
+    elif result.error is None:
+        LOGGER.info(
+            f"Updated {result.artist_name} 'Top Songs' playlist "
+            f"({result.tracks} tracks, {result.writes} writes, {result.seconds:.1f}s)"
+        )
+    else:
+        LOGGER.error(
+            f"Failed to update {result.artist_name} 'Top Songs' playlist: {result.error}"
+        )
+
+
+def summary(results: list[PlaylistResult]) -> None:
+    """Log how many playlists were updated, raise listing the failed ones."""
+    failed = [result for result in results if result.error is not None]
+    LOGGER.info(f"{len(results) - len(failed)}/{len(results)} playlists updated.")
+    if failed:
+        raise Exception(
+            "Failed 'Top Songs' playlists: "
+            + ", ".join(f"{x.artist_name} ({x.playlist_id})" for x in failed)
+        )
+
+
+def _shard(value: str) -> tuple[int, int]:
+    i, n = map(int, value.split("/"))
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"expected i/n with 1 <= i <= n, got {value}")
+    return i, n
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--only", nargs="+", metavar="ARTIST", help="artist names or playlist ids"
+    )
+    parser.add_argument(
+        "--shard", type=_shard, metavar="i/n", help="i-th of n groups of playlists"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.TOP_SONGS_WORKERS,
+        help="playlists updated at once",
+    )
+    return parser.parse_args(argv)
 
 
 @timer(LOGGER)
-def main() -> None:
+def main(argv: list[str] = None) -> None:
     LOGGER.info("Script is running")
-
-    # instantiate client
-    spotify = Spotify(
-        user_id=settings.USER_ID,
-        refresh_token=settings.SPOTIFY_REFRESH_TOKEN,
-        base64=settings.SPOTIFY_CLIENT_BASE_64,
+    args = parse_args(argv)
+    if settings.ASYNC_CLIENT:
+        return asyncio.run(main_async(args))
+
+    # for every account, their clients sharing the catalog cache
+    run_accounts(
+        LOGGER,
+        "update_top_songs",
+        lambda spotify, account: summary(
+            run(spotify, only=args.only, shard=args.shard, workers=args.workers)
+        ),
     )
+
+
+def run(
+    spotify: Spotify,
+    only: list[str] = None,
+    shard: tuple[int, int] = None,
+    workers: int = 1,
+) -> list[PlaylistResult]:
     # get artists for which I have a 'Top Songs' playlist
-    playlists = spotify.get_user_playlists(regex=".*?: Top Songs")
+    items = spotify.iter_user_playlists(regex=".*?: Top Songs")
+    playlists = _selected(_top_songs_playlists(items), only, shard)
+
+    def update(playlist: tuple[str, str]) -> PlaylistResult:
+        result = PlaylistResult(*playlist)
+        t0 = time.perf_counter()
+        try:
+            result.tracks, result.writes = update_one_playlist(spotify, *playlist)
+        except Exception as e:
+            result.error = repr(e)
+        result.seconds = time.perf_counter() - t0
+        _log_result(result)
+        return result
+
+    # update the playlists, 'workers' at once; they all share the client's rate limiter
+    return fan_out(
+        update,
+        playlists,
+        max_workers=workers,
+        logger=LOGGER,
+    )
 
-    # get artists names
-    playlists["artist"] = [x.split(":")[0] for x in playlists["name"]]
 
-    # loop trough playlists & update them
-    for playlist_id, artist_name in zip(playlists["id"], playlists["artist"]):
-        update_one_playlist(spotify, playlist_id, artist_name)
-        LOGGER.info(f"Updated {artist_name} 'Top Songs' playlist")
+async def main_async(args: argparse.Namespace) -> None:
+    async def run_account(spotify: AsyncSpotify, account) -> None:
+        summary(
+            await run_async(
+                spotify, only=args.only, shard=args.shard, workers=args.workers
+            )
+        )
+
+    await run_accounts_async(LOGGER, "update_top_songs", run_account)
+
+
+async def run_async(
+    spotify: AsyncSpotify,
+    only: list[str] = None,
+    shard: tuple[int, int] = None,
+    workers: int = 1,
+) -> list[PlaylistResult]:
+    """Same as 'run' but on top of the asyncio client."""
+    items = [x async for x in spotify.iter_user_playlists(regex=".*?: Top Songs")]
+    playlists = _selected(_top_songs_playlists(items), only, shard)
+
+    async def update(playlist: tuple[str, str]) -> PlaylistResult:
+        result = PlaylistResult(*playlist)
+        t0 = time.perf_counter()
+        try:
+            result.tracks, result.writes = await update_one_playlist_async(
+                spotify, *playlist
+            )
+        except Exception as e:
+            result.error = repr(e)
+        result.seconds = time.perf_counter() - t0
+        _log_result(result)
+        return result
+
+    return await afan_out(
+        update,
+        playlists,
+        max_in_flight=workers,
+        logger=LOGGER,
+    )
 
 
 if __name__ == "__main__":
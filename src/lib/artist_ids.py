@@ -0,0 +1,147 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from lib.concurrency import afan_out, fan_out
+from lib.utils import fold
+
+
+def match_artist(items: list[dict], name: str) -> tuple[str | None, bool]:
+    """Id of the most popular artist of search results 'items' named 'name' (folded),
+    None if there's none, and whether several artists have that name."""
+    matches = [item for item in items if fold(item["name"]) == fold(name)]
+    if not matches:
+        return None, False
+    best = max(matches, key=lambda item: item["popularity"])
+    return best["id"], len(matches) > 1
+
+
+class ArtistIds:
+    """SQLite index of the artist ids resolved from names, by folded name (case, accents
+    and spacing ignored), and of the artist of each 'Top Songs' playlist, so that an artist
+    is only searched once. A name shared by several artists is 'ambiguous': it's searched
+    again next time, its playlists aren't pinned to an artist either.
+    Use path=':memory:' for an index living only as long as the process."""
+
+    def __init__(self, path: str = ".cache/state.sqlite"):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS artist_names ("
+            "name TEXT PRIMARY KEY, artist_id TEXT, ambiguous INTEGER, resolved_at REAL);"
+            "CREATE TABLE IF NOT EXISTS playlist_artists ("
+            "playlist_id TEXT PRIMARY KEY, name TEXT, artist_id TEXT);"
+        )
+
+    def get(self, name: str) -> str | None:
+        """Id of the artist named 'name', None if unknown or ambiguous."""
+        return self.get_many([name]).get(name)
+
+    def get_many(self, names: list[str]) -> dict[str, str]:
+        """Name -> id of the 'names' known and not ambiguous."""
+        keys = {fold(name): name for name in names}
+        if not keys:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, artist_id FROM artist_names WHERE ambiguous = 0 AND name IN "
+                f"({','.join('?' * len(keys))})",
+                list(keys),
+            ).fetchall()
+        ids = dict(rows)
+        return {name: ids[fold(name)] for name in names if fold(name) in ids}
+
+    def set(self, name: str, artist_id: str, ambiguous: bool = False) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artist_names VALUES (?, ?, ?, ?)",
+                (fold(name), artist_id, int(ambiguous), time.time()),
+            )
+            self._conn.commit()
+
+    def resolve(
+        self,
+        names: list[str],
+        search: Callable[[str], list[dict]],
+        max_workers: int = 8,
+    ) -> dict[str, str]:
+        """Name -> id of 'names', 'search(name)' (-> artist objects) being only called for
+        the names not known yet, 'max_workers' at a time. Names without a match are left out."""
+        ids, missing = self._known(names)
+
+        def resolve_one(name: str) -> str | None:
+            return self._match(name, search(name))
+
+        found = fan_out(resolve_one, list(missing.values()), max_workers)
+        return self._merged(names, ids, missing, found)
+
+    async def aresolve(
+        self,
+        names: list[str],
+        search: Callable[[str], Awaitable[list[dict]]],
+        max_in_flight: int = 8,
+    ) -> dict[str, str]:
+        """asyncio version of 'resolve': 'search' is a coroutine function and the SQLite
+        reads and writes run in a thread, not to block the event loop."""
+        ids, missing = await asyncio.to_thread(self._known, names)
+
+        async def resolve_one(name: str) -> str | None:
+            return await asyncio.to_thread(self._match, name, await search(name))
+
+        found = await afan_out(resolve_one, list(missing.values()), max_in_flight)
+        return self._merged(names, ids, missing, found)
+
+    def _known(self, names: list[str]) -> tuple[dict[str, str], dict[str, str]]:
+        """Ids of the known 'names', and the others to search, once per folded name."""
+        ids = self.get_many(names)
+        return ids, {fold(name): name for name in names if name not in ids}
+
+    def _match(self, name: str, items: list[dict]) -> str | None:
+        """Id of the artist named 'name' among search results 'items', stored if found."""
+        artist_id, ambiguous = match_artist(items, name)
+        if artist_id is not None:
+            self.set(name, artist_id, ambiguous)
+        return artist_id
+
+    @staticmethod
+    def _merged(
+        names: list[str],
+        ids: dict[str, str],
+        missing: dict[str, str],
+        found: list[str | None],
+    ) -> dict[str, str]:
+        """Add the ids 'found' for the 'missing' names to 'ids'."""
+        found = dict(zip(missing, found))
+        for name in names:
+            if name not in ids and found.get(fold(name)) is not None:
+                ids[name] = found[fold(name)]
+        return ids
+
+    def playlist(self, playlist_id: str, name: str) -> str | None:
+        """Artist pinned to a playlist, None if it isn't or if it was named after another artist."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT artist_id FROM playlist_artists WHERE playlist_id = ? AND name = ?",
+                (playlist_id, fold(name)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def pin(self, playlist_id: str, name: str, artist_id: str) -> None:
+        """Pin a playlist named after 'name' to its artist, unless 'name' is ambiguous."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ambiguous FROM artist_names WHERE name = ?", (fold(name),)
+            ).fetchone()
+            if row and row[0]:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO playlist_artists VALUES (?, ?, ?)",
+                (playlist_id, fold(name), artist_id),
+            )
+            self._conn.commit()
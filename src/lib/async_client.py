@@ -0,0 +1,711 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from datetime import date
+from typing import TYPE_CHECKING, AsyncIterator, Callable
+
+import httpx
+
+from lib.artist_ids import ArtistIds, match_artist
+from lib.cache import ResponseCache
+from lib.metrics import Metrics
+from lib.models import Artist, ArtistIndex
+from lib.payloads import (
+    is_release,
+    match_playlists,
+    older_than,
+    prepare_top_albums,
+    rank_top_songs,
+    release_window,
+    split_groups,
+    top_songs_candidates,
+    uri_id,
+)
+from lib.playlist_sync import PlaylistDiff, diff_playlist, insertions
+from lib.ratelimit import RateLimiter, retry_after
+from lib.refresh import Refresh, TokenManager
+from lib.session import ConnectionTrace, async_connection_stats
+from lib.utils import n_chunks, remove_nones
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AsyncSpotify:
+    """asyncio counterpart of lib.client.Spotify, exposing the same endpoints as coroutines.
+    Use it as an async context manager so that the connection pool gets closed:
+        async with AsyncSpotify(user_id, refresh_token, base64) as spotify:
+            artists = await spotify.get_favorite_artists()
+    """
+
+    _BASE_URL = "https://api.spotify.com/v1/"
+    _MAX_RETRIES = 5
+    _IDEMPOTENT = ("GET", "PUT", "DELETE")
+
+    def __init__(
+        self,
+        user_id,
+        refresh_token,
+        base64,
+        pool_size: int = 100,
+        http2: bool = False,
+        rate_limiter: RateLimiter = None,
+        cache: ResponseCache = None,
+        artists: ArtistIndex = None,
+        base_url: str = None,
+        token_url: str = None,
+        metrics: Metrics = None,
+        token_path: str = None,
+        client: httpx.AsyncClient = None,
+        artist_ids: ArtistIds = None,
+    ):
+        """:http2: requires the 'h2' package (pip install httpx[http2])
+        :cache: optional cache of the catalog GET requests
+        :artists: index of the artists already known, shared with other clients of the run
+        :artist_ids: artist ids already resolved from names (default: in-memory)
+        :base_url, token_url: Web API and token endpoint, to run against a mock server
+        :metrics: where to send the metrics of every call (default: in-memory histogram)
+        :token_path: see Spotify
+        :client: connection pool of another AsyncSpotify (e.g. of another user),
+        left open by 'aclose'
+        """
+        self.user_id = user_id
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.artists = artists if artists is not None else ArtistIndex()
+        self.artist_ids = (
+            artist_ids if artist_ids is not None else ArtistIds(":memory:")
+        )
+        self._owns_client = client is None
+        self.client = client or httpx.AsyncClient(
+            base_url=base_url or self._BASE_URL,
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            http2=http2,
+            timeout=30,
+            event_hooks={"request": [ConnectionTrace()]},
+        )
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.tokens = TokenManager(
+            Refresh(refresh_token, base64, url=token_url, metrics=self.metrics),
+            path=token_path,
+        )
+        self.headers = {
+            "Accept": "application/json",
+            "Content-type": "application/json",
+        }
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._owns_client:
+            await self.client.aclose()
+
+    ###################
+    # REQUEST METHODS #
+    ###################
+    async def _request(
+        self,
+        method: str,
+        endpoint: str,
+        headers: dict = None,
+        cache: str = None,
+        on_send: Callable[[], None] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """Same retry policy and metrics as Spotify._request."""
+        refreshed = False
+        started = time.perf_counter()
+        waited = 0.0
+        for tries in range(1, self._MAX_RETRIES + 1):
+            waited += await self.rate_limiter.acquire_async()
+            # refreshing blocks (file lock, sync request): done in a thread
+            token = self.tokens.fresh() or await asyncio.to_thread(self.tokens.get)
+            if on_send is not None:
+                on_send()
+            r = await self.client.request(
+                method,
+                endpoint,
+                headers={
+                    **self.headers,
+                    "Authorization": f"Bearer {token}",
+                    **(headers or {}),
+                },
+                **kwargs,
+            )
+            if r.status_code == 429:
+                wait = retry_after(r.headers.get("Retry-After"), 2**tries)
+                self.rate_limiter.throttle(wait)
+            elif r.status_code >= 500 and method in self._IDEMPOTENT:
+                wait = min(2**tries, 60) * random.random()
+                await asyncio.sleep(wait)
+            elif r.status_code == 401 and not refreshed:
+                refreshed = True
+                self.tokens.invalidate(token)
+                continue
+            else:
+                if r.is_success:
+                    self.rate_limiter.success()
+                break
+            LOGGER.warning(
+                f"{method} {endpoint}: {r.status_code}, retry {tries} in {wait:.1f}s"
+            )
+        self.metrics.record(
+            method,
+            endpoint,
+            r.status_code,
+            started,
+            retries=tries - 1,
+            bytes=len(r.content),
+            cache=cache,
+            waited_s=waited,
+        )
+        return r
+
+    async def _get(self, endpoint, params=None, **kwargs):
+        """See Spotify._get"""
+        ttl = self.cache.ttl(endpoint) if self.cache is not None else None
+        if ttl is None:
+            return await self._request("GET", endpoint, params=params, **kwargs)
+
+        started = time.perf_counter()
+        key = self.cache.key(endpoint, params)
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh:
+            self.metrics.record(
+                "GET", endpoint, 200, started, bytes=len(entry.body), cache="hit"
+            )
+            return httpx.Response(200, content=entry.body)
+
+        headers = {"If-None-Match": entry.etag} if entry and entry.etag else {}
+        r = await self._request(
+            "GET",
+            endpoint,
+            params=params,
+            headers=headers,
+            cache="stale" if entry is not None else "miss",
+            **kwargs,
+        )
+        if r.status_code == 304 and entry is not None:
+            self.cache.revalidate(key, ttl)
+            return httpx.Response(200, content=entry.body)
+        if r.is_success:
+            self.cache.set(key, r.content, r.headers.get("ETag"), ttl)
+        return r
+
+    async def _put(self, endpoint, params=None, json=None, **kwargs):
+        return await self._request("PUT", endpoint, params=params, json=json, **kwargs)
+
+    async def _post(self, endpoint, params=None, json=None, **kwargs):
+        return await self._request("POST", endpoint, params=params, json=json, **kwargs)
+
+    def connection_stats(self) -> dict:
+        """See Spotify.connection_stats (requests of every client sharing the pool)."""
+        return async_connection_stats(self.client)
+
+    #############
+    # ENDPOINTS #
+    #############
+    async def get_favorite_artists(
+        self, return_: str = "id", type: str = "artist"
+    ) -> list[str] | list[Artist]:
+        """See Spotify.get_favorite_artists"""
+        if return_ not in ["id", "name", "record"]:
+            raise ValueError(
+                "'return_' parameter should be one of ['id', 'name', 'record']."
+            )
+        # followed artists are only listed once per artist index (e.g. per run)
+        if type == "artist" and self.artists.followed is not None:
+            artists = self.artists.followed
+        else:
+            artists = []
+            after = None
+            while True:
+                params = {"type": type, "after": after, "limit": "50"}
+                r = await self._get("me/following", params=remove_nones(params))
+
+                for item in r.json()["artists"]["items"]:
+                    artists.append(Artist.from_json(item))
+
+                after = r.json()["artists"]["cursors"].get("after")
+                if after is None:
+                    break
+
+            self.artists.add(artists)
+            if type == "artist":
+                self.artists.followed = artists
+        if return_ == "record":
+            return artists
+        return [getattr(artist, return_) for artist in artists]
+
+    async def get_artist_name(self, artist_id: str) -> str:
+        if artist_id in self.artists:
+            return self.artists.get(artist_id).name
+        r = await self._get(f"artists/{artist_id}")
+        self.artists.add([Artist.from_json(r.json())])
+        return r.json()["name"]
+
+    async def get_artists(self, artists_ids: list[str]) -> list[dict]:
+        """See Spotify.get_artists (chunks are requested concurrently)"""
+        chunks = await asyncio.gather(
+            *(
+                self._get("artists", params={"ids": ",".join(chunk)})
+                for chunk in n_chunks(artists_ids, chunk_size=50)
+            )
+        )
+        artists = [artist for r in chunks for artist in r.json()["artists"]]
+        self.artists.add([Artist.from_json(a) for a in artists if a is not None])
+        return artists
+
+    async def get_artist_releases(
+        self,
+        artist_id: str,
+        start_date: date = None,
+        end_date: date = None,
+        include: str = "album,single,appears_on",
+        market: str = "FR",
+        limit: int = 50,
+    ) -> pd.DataFrame:
+        """See Spotify.get_artist_releases"""
+        import pandas as pd
+
+        items = self.iter_artist_releases(
+            artist_id, start_date, end_date, include, market, limit
+        )
+        return pd.DataFrame([item async for item in items])
+
+    async def iter_artist_releases(
+        self,
+        artist_id: str,
+        start_date: date = None,
+        end_date: date = None,
+        include: str = "album,single,appears_on",
+        market: str = "FR",
+        limit: int = 50,
+    ) -> AsyncIterator[dict]:
+        """See Spotify.iter_artist_releases"""
+        start_date, end_date = release_window(start_date, end_date)
+        items = self.iter_artist_albums(
+            artist_id,
+            include=include,
+            market=market,
+            stop_before=start_date,
+            limit=limit,
+        )
+        async for item in items:
+            if is_release(item, start_date, end_date):
+                yield item
+
+    async def iter_artist_albums(
+        self,
+        artist_id: str,
+        include: str = "album,single,appears_on",
+        market: str = "FR",
+        stop_before: date = None,
+        limit: int = 50,
+    ) -> AsyncIterator[dict]:
+        """See Spotify.iter_artist_albums"""
+        endpoint = f"artists/{artist_id}/albums"
+        params = {"market": market, "limit": limit, "include_groups": include}
+        page = (await self._get(endpoint, params={**params, "offset": 0})).json()
+        if stop_before is None or page["next"] is None:
+            offset = 0
+            while True:
+                for item in page["items"]:
+                    yield item
+                if page["next"] is None:
+                    return
+                offset += limit
+                r = await self._get(endpoint, params={**params, "offset": offset})
+                page = r.json()
+
+        for group, items, complete in split_groups(page, include.split(",")):
+            for item in items:
+                yield item
+            if complete or (items and older_than(items, stop_before)):
+                continue
+            offset = len(items)
+            while True:
+                r = await self._get(
+                    endpoint,
+                    params={**params, "include_groups": group, "offset": offset},
+                )
+                page = r.json()
+                for item in page["items"]:
+                    yield item
+                if page["next"] is None or older_than(page["items"], stop_before):
+                    break
+                offset += limit
+
+    async def get_artist_albums_total(
+        self,
+        artist_id: str,
+        include: str = "album,single,appears_on",
+        market: str = "FR",
+        limit: int = 50,
+    ) -> int:
+        """See Spotify.get_artist_albums_total"""
+        params = {"market": market, "limit": limit, "include_groups": include}
+        r = await self._get(
+            f"artists/{artist_id}/albums", params={**params, "offset": 0}
+        )
+        return r.json()["total"]
+
+    async def get_album(self, album_id: str, market: str = "FR") -> dict:
+        r = await self._get(f"albums/{album_id}", params={"market": market})
+        return r.json()
+
+    async def get_albums(self, albums_ids: list[str], market: str = "FR") -> list[dict]:
+        """See Spotify.get_albums (chunks are requested concurrently)"""
+        chunks = await asyncio.gather(
+            *(
+                self._get("albums", params={"ids": ",".join(chunk), "market": market})
+                for chunk in n_chunks(albums_ids, chunk_size=20)
+            )
+        )
+        return [album for r in chunks for album in r.json()["albums"]]
+
+    async def get_tracks(self, tracks_ids: list[str], market: str = "FR") -> list[dict]:
+        """See Spotify.get_tracks (chunks are requested concurrently)"""
+        chunks = await asyncio.gather(
+            *(
+                self._get("tracks", params={"ids": ",".join(chunk), "market": market})
+                for chunk in n_chunks(tracks_ids, chunk_size=50)
+            )
+        )
+        return [track for r in chunks for track in r.json()["tracks"]]
+
+    async def get_tracks_from_album(
+        self, album_id: str, market: str = "FR", limit: int = 50, offset: int = 0
+    ) -> pd.DataFrame:
+        import pandas as pd
+
+        params = {"limit": limit, "market": market, "offset": offset}
+        r = await self._get(f"albums/{album_id}/tracks", params=params)
+        return pd.DataFrame(r.json()["items"])
+
+    async def iter_album_tracks(
+        self, album_id: str, market: str = "FR", limit: int = 50, offset: int = 0
+    ) -> AsyncIterator[dict]:
+        """See Spotify.iter_album_tracks"""
+        params = {"limit": limit, "market": market, "offset": offset}
+        while True:
+            r = await self._get(f"albums/{album_id}/tracks", params=params)
+            page = r.json()
+            for item in page["items"]:
+                yield item
+            if page["next"] is None:
+                return
+            params["offset"] += limit
+
+    async def get_devices(self) -> dict:
+        r = await self._get("me/player/devices")
+        return r.json()
+
+    async def add_to_queue(
+        self,
+        tracks_uris: list[str],
+        device_id: str = None,
+        window: int = 1,
+        market: str = "FR",
+    ) -> list[dict]:
+        """See Spotify.add_to_queue"""
+        semaphore = asyncio.Semaphore(window)
+
+        async def queue(uri, track_uri, previous, sent) -> dict | None:
+            if track_uri is None:
+                sent.set()
+                return {"uri": uri, "status": 404, "reason": "Not found"}
+            async with semaphore:
+                try:
+                    if previous is not None:
+                        await previous.wait()
+                    params = {"uri": track_uri, "device_id": device_id}
+                    r = await self._post(
+                        "me/player/queue",
+                        params=remove_nones(params),
+                        on_send=sent.set,
+                    )
+                except httpx.HTTPError as e:
+                    return {"uri": track_uri, "status": None, "reason": repr(e)}
+                finally:
+                    sent.set()
+            if not r.is_success:
+                return {"uri": track_uri, "status": r.status_code, "reason": r.text}
+            return None
+
+        # the tracks are queued by their tasks while the next ones are being resolved
+        tasks, previous = [], None
+        try:
+            async for uri, track_uri in self.iter_queue_uris(tracks_uris, market):
+                sent = asyncio.Event()
+                tasks.append(asyncio.create_task(queue(uri, track_uri, previous, sent)))
+                previous = sent
+        finally:
+            results = await asyncio.gather(*tasks)
+        return [x for x in results if x is not None]
+
+    async def iter_queue_uris(
+        self, uris: list[str], market: str = "FR"
+    ) -> AsyncIterator[tuple[str, str | None]]:
+        """See Spotify.iter_queue_uris"""
+        albums_ids = [uri_id(uri) for uri in uris if uri.startswith("spotify:album:")]
+        albums = await self.get_albums(list(dict.fromkeys(albums_ids)), market=market)
+        albums = {album["id"]: album for album in albums if album is not None}
+        for uri in uris:
+            if uri.startswith("spotify:album:"):
+                album = albums.get(uri_id(uri))
+                if album is None:
+                    yield uri, None
+                    continue
+                page = album["tracks"]
+                for track in page["items"]:
+                    yield uri, track["uri"]
+                if page["next"] is not None:
+                    async for track in self.iter_album_tracks(
+                        album["id"], market, offset=len(page["items"])
+                    ):
+                        yield uri, track["uri"]
+            elif uri.startswith("spotify:playlist:"):
+                async for track in self.iter_playlist_items(
+                    uri_id(uri), market, fields="items(track(uri))"
+                ):
+                    yield uri, track["uri"]
+            else:
+                yield uri, uri
+
+    async def create_playlist(
+        self,
+        name: str,
+        public: bool = False,
+        collaborative: bool = False,
+        description: str = None,
+    ):
+        data = {
+            "name": name,
+            "public": public,
+            "collaborative": collaborative,
+            "description": description,
+        }
+        r = await self._post(f"users/{self.user_id}/playlists", json=remove_nones(data))
+        return r.json()["id"]
+
+    async def change_playlist_details(
+        self,
+        playlist_id: str,
+        name: str = None,
+        public: bool = None,
+        collaborative: bool = None,
+        description: str = None,
+    ) -> None:
+        data = {
+            "name": name,
+            "public": public,
+            "collaborative": collaborative,
+            "description": description,
+        }
+        r = await self._put(f"playlists/{playlist_id}", json=remove_nones(data))
+        if not r.is_success:
+            raise Exception(r.status_code, r.reason_phrase, r.text)
+
+    async def get_songs_from_playlist(
+        self,
+        paylist_id: str,
+        market: str = "FR",
+        fields: str = "items(track(id,name,uri))",
+    ) -> pd.DataFrame:
+        import pandas as pd
+
+        items = self.iter_playlist_items(paylist_id, market=market, fields=fields)
+        return pd.DataFrame([item async for item in items])
+
+    async def iter_playlist_items(
+        self,
+        playlist_id: str,
+        market: str = "FR",
+        fields: str | None = "items(track(id,name,uri))",
+        limit: int = 100,
+        prefetch: bool = True,
+    ) -> AsyncIterator[dict]:
+        """See Spotify.iter_playlist_items (the next page is prefetched in a task)"""
+        endpoint = f"playlists/{playlist_id}/tracks"
+
+        async def get_page(offset: int) -> dict:
+            params = {
+                "market": market,
+                "fields": f"next,{fields}" if fields else None,
+                "limit": limit,
+                "offset": offset,
+            }
+            return (await self._get(endpoint, params=remove_nones(params))).json()
+
+        following = None
+        try:
+            offset, page = 0, await get_page(0)
+            while True:
+                offset += limit
+                last = page["next"] is None
+                if not last and prefetch:
+                    following = asyncio.create_task(get_page(offset))
+                for item in page["items"]:
+                    if item["track"] is not None:
+                        yield item["track"]
+                if last:
+                    return
+                page = await following if following else await get_page(offset)
+                following = None
+        finally:
+            if following is not None:
+                following.cancel()
+
+    async def update_playlist_items(
+        self, playlist_id: str, tracks_uris: list[str]
+    ) -> None:
+        await self._write_playlist(playlist_id, PlaylistDiff(replace=tracks_uris))
+
+    async def get_playlist_snapshot(
+        self, playlist_id: str
+    ) -> tuple[str, list[str | None]]:
+        """See Spotify.get_playlist_snapshot"""
+        params = {"fields": "snapshot_id,tracks(next,items(track(uri)))"}
+        playlist = (await self._get(f"playlists/{playlist_id}", params=params)).json()
+        page = playlist["tracks"]
+        uris = []
+        params = {"fields": "next,items(track(uri))", "limit": 100, "offset": 0}
+        while True:
+            uris.extend(x["track"] and x["track"]["uri"] for x in page["items"])
+            if page["next"] is None:
+                return playlist["snapshot_id"], uris
+            params["offset"] = len(uris)
+            r = await self._get(f"playlists/{playlist_id}/tracks", params=params)
+            page = r.json()
+
+    async def sync_playlist(self, playlist_id: str, tracks_uris: list[str]) -> int:
+        """See Spotify.sync_playlist"""
+        snapshot_id, current = await self.get_playlist_snapshot(playlist_id)
+        diff = diff_playlist(current, tracks_uris)
+        await self._write_playlist(playlist_id, diff, snapshot_id)
+        return len(diff)
+
+    async def _write_playlist(
+        self, playlist_id: str, diff: PlaylistDiff, snapshot_id: str = None
+    ) -> str | None:
+        """See Spotify._write_playlist (requests are sent one after the other)"""
+        for method, body in diff.requests():
+            if method != "POST" and snapshot_id is not None:
+                body["snapshot_id"] = snapshot_id
+            r = await self._request(
+                method, f"playlists/{playlist_id}/tracks", json=body
+            )
+            if not r.is_success:
+                raise Exception(r.status_code, r.reason_phrase, r.text)
+            snapshot_id = r.json().get("snapshot_id", snapshot_id)
+        return snapshot_id
+
+    async def get_user_playlists(
+        self, regex: str = None, limit: int = 50, offset: int = 0
+    ) -> pd.DataFrame:
+        import pandas as pd
+
+        items = self.iter_user_playlists(regex, limit, offset)
+        return pd.DataFrame([item async for item in items])
+
+    async def iter_user_playlists(
+        self, regex: str = None, limit: int = 50, offset: int = 0
+    ) -> AsyncIterator[dict]:
+        """See Spotify.iter_user_playlists"""
+        params = {"limit": limit, "offset": offset}
+        while True:
+            items = (await self._get("me/playlists", params=params)).json()["items"]
+            if not items:
+                return
+            for item in match_playlists(items, regex):
+                yield item
+            params["offset"] += limit
+
+    async def save_albums(self, ids: list[str]) -> httpx.Response:
+        return await self._put("me/albums", params={"ids": ",".join(ids)})
+
+    async def get_artist_id(self, name: str) -> str:
+        """See Spotify.get_artist_id (the index is read and written in a thread)"""
+        artist_id = await asyncio.to_thread(self.artist_ids.get, name)
+        if artist_id is None:
+            artist_id, ambiguous = match_artist(await self._search_artists(name), name)
+            if artist_id is None:
+                raise Exception(
+                    f"Can't match an artist with this {name=:}, try a different name!"
+                )
+            await asyncio.to_thread(self.artist_ids.set, name, artist_id, ambiguous)
+        return artist_id
+
+    async def get_artist_ids(
+        self, names: list[str], max_in_flight: int = 8
+    ) -> dict[str, str]:
+        """See Spotify.get_artist_ids"""
+        return await self.artist_ids.aresolve(
+            names, self._search_artists, max_in_flight
+        )
+
+    async def get_playlist_artist_id(self, playlist_id: str, artist_name: str) -> str:
+        """See Spotify.get_playlist_artist_id"""
+        artist_id = await asyncio.to_thread(
+            self.artist_ids.playlist, playlist_id, artist_name
+        )
+        if artist_id is None:
+            artist_id = await self.get_artist_id(artist_name)
+            await asyncio.to_thread(
+                self.artist_ids.pin, playlist_id, artist_name, artist_id
+            )
+        return artist_id
+
+    async def _search_artists(self, name: str) -> list[dict]:
+        r = await self._get("search", params={"q": name.lower(), "type": "artist"})
+        return r.json()["artists"]["items"]
+
+    async def get_artist_top_songs(
+        self,
+        artist_id: str,
+        n: int = 50,
+        include: str = "single,album,appears_on",
+        method: str = "popularity",
+        country: str = "FR",
+        exclude: list[str] = None,
+    ) -> list[str]:
+        """See Spotify.get_artist_top_songs"""
+        items = self.iter_artist_albums(artist_id, include=include, market=country)
+        albums = prepare_top_albums([item async for item in items], exclude)
+        if not albums:
+            return []
+
+        # get songs from albums now, all albums at once
+        async def album_tracks(album_id: str) -> list[dict]:
+            return [x async for x in self.iter_album_tracks(album_id, market=country)]
+
+        tracks = await asyncio.gather(*(album_tracks(x["id"]) for x in albums))
+        candidates = top_songs_candidates(albums, tracks, artist_id)
+
+        if method == "popularity":
+            ids = [x["track_id"] for x in candidates]
+            for x, track in zip(candidates, await self.get_tracks(ids, market=country)):
+                # unavailable tracks are None, ranked last as in CatalogMirror
+                x["popularity"] = track["popularity"] if track is not None else 0
+        return rank_top_songs(candidates, n, method)
+
+    async def add_to_playlist(
+        self, playlist_id: str, tracks_uris: str, position: int = 0
+    ) -> None:
+        adds = insertions(tracks_uris, position)
+        await self._write_playlist(playlist_id, PlaylistDiff(adds=adds))
+
+    async def update_playlist(self, playlist_id: str, uris: str) -> None:
+        await self._write_playlist(playlist_id, PlaylistDiff(replace=uris))
@@ -0,0 +1,156 @@
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlencode
+
+# Time-to-live (seconds) of the catalog endpoints worth caching, first match wins.
+# Anything else (me/*, playlists/*, search, ...) is user data and is never cached.
+DEFAULT_TTLS = {
+    r"albums/[^/]+/tracks": 30 * 24 * 3600,
+    r"albums/[^/]+": 7 * 24 * 3600,
+    r"albums": 7 * 24 * 3600,
+    r"artists/[^/]+/albums": 3600,
+    r"artists/[^/]+": 24 * 3600,
+    r"artists": 24 * 3600,
+    r"tracks": 24 * 3600,
+}
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    etag: str | None
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+
+class ResponseCache:
+    """SQLite-backed cache of GET responses, keyed by endpoint + params.
+    Entries expire after a per-endpoint TTL, after which they are revalidated with their
+    ETag (a 304 costs no payload). Least recently used entries are evicted beyond 'max_bytes'.
+    Use path=':memory:' for a cache living only as long as the process."""
+
+    def __init__(
+        self,
+        path: str = ".cache/spotify.sqlite",
+        ttls: dict[str, int] = None,
+        max_bytes: int = 256 * 1024**2,
+    ):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._ttls = [
+            (re.compile(pattern), ttl)
+            for pattern, ttl in (ttls if ttls is not None else DEFAULT_TTLS).items()
+        ]
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, body BLOB, etag TEXT, "
+            "expires_at REAL, last_access REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)"
+        )
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+        ).fetchone()[0]
+        self._stats = {
+            "hits": 0,
+            "stale": 0,
+            "misses": 0,
+            "revalidated": 0,
+            "evicted": 0,
+        }
+
+    def ttl(self, endpoint: str) -> int | None:
+        """TTL of an endpoint, None if it shouldn't be cached."""
+        for pattern, ttl in self._ttls:
+            if pattern.fullmatch(endpoint):
+                return ttl
+        return None
+
+    @staticmethod
+    def key(endpoint: str, params=None) -> str:
+        if not params:
+            return endpoint
+        items = params.items() if isinstance(params, dict) else params
+        return (
+            endpoint
+            + "?"
+            + urlencode(sorted((k, v) for k, v in items if v is not None))
+        )
+
+    def get(self, key: str) -> CacheEntry | None:
+        """Return the entry stored under 'key' (fresh or not), None if there's none."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            entry = CacheEntry(*row)
+            self._stats["hits" if entry.fresh else "stale"] += 1
+            return entry
+
+    def set(self, key: str, body: bytes, etag: str | None, ttl: int) -> None:
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT LENGTH(body) FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, body, etag, now + ttl, now),
+            )
+            self._size += len(body) - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def revalidate(self, key: str, ttl: int) -> None:
+        """The server answered 304: the stored body is good for another 'ttl'."""
+        now = time.time()
+        with self._lock:
+            self._stats["revalidated"] += 1
+            self._conn.execute(
+                "UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?",
+                (now + ttl, now, key),
+            )
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(body) FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                self._stats["evicted"] += 1
+                if self._size <= self.max_bytes:
+                    break
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self._stats[k] for k in ("hits", "stale", "misses"))
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                "size_mb": round(self._size / 1024**2, 2),
+            }
@@ -1,93 +1,263 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from typing import TYPE_CHECKING, Callable, Iterator
 
-import backoff
-import pandas as pd
 import requests
 
-from lib.refresh import Refresh
-from lib.utils import backoff_hdlr, n_chunks, remove_nones
+from lib.artist_ids import ArtistIds, match_artist
+from lib.cache import ResponseCache
+from lib.metrics import Metrics
+from lib.models import Artist, ArtistIndex
+from lib.payloads import (
+    is_release,
+    match_playlists,
+    older_than,
+    prepare_top_albums,
+    rank_top_songs,
+    release_window,
+    split_groups,
+    top_songs_candidates,
+    uri_id,
+)
+from lib.playlist_sync import PlaylistDiff, diff_playlist, insertions
+from lib.ratelimit import RateLimiter, retry_after
+from lib.refresh import Refresh, TokenManager
+from lib.session import connection_stats, create_session
+from lib.utils import n_chunks, remove_nones
+
+if TYPE_CHECKING:  # pandas is only imported by the methods returning DataFrames
+    import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
 
 
 class Spotify:
     _BASE_URL = "https://api.spotify.com/v1/"
 
-    def __init__(self, user_id, refresh_token, base64):
+    _MAX_RETRIES = 5
+    _IDEMPOTENT = ("GET", "PUT", "DELETE")
+
+    def __init__(
+        self,
+        user_id,
+        refresh_token,
+        base64,
+        session: requests.Session = None,
+        pool_size: int = 16,
+        rate_limiter: RateLimiter = None,
+        cache: ResponseCache = None,
+        artists: ArtistIndex = None,
+        base_url: str = None,
+        token_url: str = None,
+        metrics: Metrics = None,
+        token_path: str = None,
+        artist_ids: ArtistIds = None,
+    ):
+        """:cache: optional cache of the catalog GET requests
+        :artists: index of the artists already known, shared with other clients of the run
+        :artist_ids: artist ids already resolved from names (default: in-memory)
+        :base_url, token_url: Web API and token endpoint, to run against a mock server
+        :metrics: where to send the metrics of every call (default: in-memory histogram)
+        :token_path: file caching the access token, shared by the clients using it
+        """
         self.user_id = user_id
-        refresh = Refresh(refresh_token, base64)
-        self.spotify_token = refresh.refresh()
+        self.base_url = base_url or self._BASE_URL
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.cache = cache
+        self.artists = artists if artists is not None else ArtistIndex()
+        self.artist_ids = (
+            artist_ids if artist_ids is not None else ArtistIds(":memory:")
+        )
+        self.session = (
+            session if session is not None else create_session(pool_size=pool_size)
+        )
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.tokens = TokenManager(
+            Refresh(
+                refresh_token,
+                base64,
+                session=self.session,
+                url=token_url,
+                metrics=self.metrics,
+            ),
+            path=token_path,
+        )
         self.headers = {
             "Accept": "application/json",
             "Content-type": "application/json",
-            "Authorization": f"Bearer {self.spotify_token}",
         }
 
     ###################
     # REQUEST METHODS #
     ###################
-    @backoff.on_predicate(
-        backoff.expo,
-        predicate=lambda r: 400 <= r.status_code < 500,
-        max_time=300,
-        on_backoff=backoff_hdlr,
-    )
-    def _get(self, endpoint, params=[], **kwargs):
-        r = requests.get(
-            self._BASE_URL + endpoint, params=params, headers=self.headers, **kwargs
+    def _request(
+        self,
+        method: str,
+        endpoint: str,
+        headers: dict = None,
+        cache: str = None,
+        on_send: Callable[[], None] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """Send a request through the shared rate limiter.
+        429 -> wait for 'Retry-After' (every caller pauses) and retry
+        5xx -> exponential backoff and retry (idempotent methods only)
+        401 -> drop the token and retry once with a new one
+        other statuses are returned as is.
+        The call (retries included) is recorded in 'self.metrics', 'cache' being its cache status.
+        'on_send' is called right before each attempt is sent (e.g. to send requests in order).
+        """
+        refreshed = False
+        started = time.perf_counter()
+        waited = 0.0
+        for tries in range(1, self._MAX_RETRIES + 1):
+            waited += self.rate_limiter.acquire()
+            token = self.tokens.get()
+            if on_send is not None:
+                on_send()
+            r = self.session.request(
+                method,
+                self.base_url + endpoint,
+                headers={
+                    **self.headers,
+                    "Authorization": f"Bearer {token}",
+                    **(headers or {}),
+                },
+                **kwargs,
+            )
+            if r.status_code == 429:
+                wait = retry_after(r.headers.get("Retry-After"), 2**tries)
+                self.rate_limiter.throttle(wait)
+            elif r.status_code >= 500 and method in self._IDEMPOTENT:
+                wait = min(2**tries, 60) * random.random()
+                time.sleep(wait)
+            elif r.status_code == 401 and not refreshed:
+                refreshed = True
+                self.tokens.invalidate(token)
+                continue
+            else:
+                if r.ok:
+                    self.rate_limiter.success()
+                break
+            LOGGER.warning(
+                f"{method} {endpoint}: {r.status_code}, retry {tries} in {wait:.1f}s"
+            )
+        self.metrics.record(
+            method,
+            endpoint,
+            r.status_code,
+            started,
+            retries=tries - 1,
+            bytes=len(r.content),
+            cache=cache,
+            waited_s=waited,
         )
         return r
 
-    def _put(self, endpoint, data=[], params=[], **kwargs):
-        r = requests.put(
-            self._BASE_URL + endpoint,
-            data=data,
+    def _get(self, endpoint, params=[], **kwargs):
+        ttl = self.cache.ttl(endpoint) if self.cache is not None else None
+        if ttl is None:
+            return self._request("GET", endpoint, params=params, **kwargs)
+
+        started = time.perf_counter()
+        key = self.cache.key(endpoint, params)
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh:
+            self.metrics.record(
+                "GET", endpoint, 200, started, bytes=len(entry.body), cache="hit"
+            )
+            return _cached_response(entry.body)
+
+        headers = {"If-None-Match": entry.etag} if entry and entry.etag else {}
+        r = self._request(
+            "GET",
+            endpoint,
             params=params,
-            headers=self.headers,
+            headers=headers,
+            cache="stale" if entry is not None else "miss",
             **kwargs,
         )
+        if r.status_code == 304 and entry is not None:
+            self.cache.revalidate(key, ttl)
+            return _cached_response(entry.body)
+        if r.ok:
+            self.cache.set(key, r.content, r.headers.get("ETag"), ttl)
         return r
 
+    def _put(self, endpoint, data=[], params=[], **kwargs):
+        return self._request("PUT", endpoint, data=data, params=params, **kwargs)
+
     def _post(self, endpoint, data=[], json=[], **kwargs):
-        r = requests.post(
-            self._BASE_URL + endpoint,
-            data=data,
-            json=json,
-            headers=self.headers,
-            **kwargs,
-        )
-        return r
+        return self._request("POST", endpoint, data=data, json=json, **kwargs)
+
+    def connection_stats(self) -> dict:
+        """Number of HTTP requests sent and connections opened/reused so far."""
+        return connection_stats(self.session)
 
     #############
     # ENDPOINTS #
     #############
     def get_favorite_artists(
         self, return_: str = "id", type: str = "artist"
-    ) -> list[str]:
-        """Get ids/name of the artists I follow.
-        :return_: Can be one in ['id', 'name']
+    ) -> list[str] | list[Artist]:
+        """Get ids/name/records of the artists I follow, and add them to the artist index.
+        :return_: Can be one in ['id', 'name', 'record'] ('record' returns lib.models.Artist)
         Adapted from https://developer.spotify.com/documentation/web-api/reference/#/operations/get-followed"""
-        if return_ not in ["id", "name"]:
-            raise ValueError("'return_' parameter should be one of ['id', 'name'].")
-        # loop to get all artists id (limit: 50 artists per request)
-        artists = []
-        after = None
-        while True:
-            params = {"type": type, "after": after, "limit": "50"}
-            r = self._get("me/following", params=params)
-
-            for item in r.json()["artists"]["items"]:
-                artists.append(item.get(return_))
-
-            after = r.json()["artists"]["cursors"].get("after")
-            if after is None:
-                break
-
-        return artists
+        if return_ not in ["id", "name", "record"]:
+            raise ValueError(
+                "'return_' parameter should be one of ['id', 'name', 'record']."
+            )
+        # followed artists are only listed once per artist index (e.g. per run)
+        if type == "artist" and self.artists.followed is not None:
+            artists = self.artists.followed
+        else:
+            # loop to get all artists (limit: 50 artists per request)
+            artists = []
+            after = None
+            while True:
+                params = {"type": type, "after": after, "limit": "50"}
+                r = self._get("me/following", params=params)
+
+                for item in r.json()["artists"]["items"]:
+                    artists.append(Artist.from_json(item))
+
+                after = r.json()["artists"]["cursors"].get("after")
+                if after is None:
+                    break
+
+            self.artists.add(artists)
+            if type == "artist":
+                self.artists.followed = artists
+        if return_ == "record":
+            return artists
+        return [getattr(artist, return_) for artist in artists]
 
     def get_artist_name(self, artist_id: str) -> str:
-        """Get artist's name given their id."""
+        """Get artist's name given their id (looked up in the artist index first)."""
+        if artist_id in self.artists:
+            return self.artists.get(artist_id).name
         r = self._get(f"artists/{artist_id}")
+        self.artists.add([Artist.from_json(r.json())])
         return r.json()["name"]
 
+    def get_artists(self, artists_ids: list[str]) -> list[dict]:
+        """Get Spotify catalog information for several artists, 50 per request.
+        Adapted from https://developer.spotify.com/documentation/web-api/reference/get-multiple-artists
+        """
+        artists = []
+        for chunk in n_chunks(artists_ids, chunk_size=50):
+            r = self._get("artists", params={"ids": ",".join(chunk)})
+            artists.extend(r.json()["artists"])
+        self.artists.add([Artist.from_json(a) for a in artists if a is not None])
+        return artists
+
     def get_artist_releases(
         self,
         artist_id: str,
@@ -95,35 +265,99 @@ class Spotify:
         end_date: date = None,
         include: str = "album,single,appears_on",
         market: str = "FR",
-        limit: str = 50,
-        offset: str = 0,
+        limit: int = 50,
     ) -> pd.DataFrame:
-        """Get artist's new releases.
+        """Get artist's new releases (default: last 7 days).
+        Pages are fetched until releases get older than 'start_date'.
         Adapted from https://developer.spotify.com/documentation/web-api/reference/get-an-artists-albums"""
-        if start_date is None:
-            start_date = (pd.Timestamp.utcnow() - pd.Timedelta(days=7)).date()
-        if end_date is None:
-            end_date = (pd.Timestamp.utcnow().date(),)
-
-        params = {
-            "market": market,
-            "limit": limit,
-            "include_groups": include,
-            "offset": offset,
-        }
-        r = self._get(f"artists/{artist_id}/albums", params=params)
-        df = pd.DataFrame(r.json()["items"])
+        import pandas as pd
 
-        if df.empty:
-            return df
+        return pd.DataFrame(
+            list(
+                self.iter_artist_releases(
+                    artist_id, start_date, end_date, include, market, limit
+                )
+            )
+        )
 
-        df["various_artists"] = df["artists"].apply(
-            lambda x: x[0]["name"] == "Various Artists"
-        )  # flag 'various artists' albums
-        df = df.query(
-            f"(release_date >= '{start_date.isoformat()}') & (release_date <= '{end_date.isoformat()}') & (album_type != 'compilation') & (various_artists == False)"
+    def iter_artist_releases(
+        self,
+        artist_id: str,
+        start_date: date = None,
+        end_date: date = None,
+        include: str = "album,single,appears_on",
+        market: str = "FR",
+        limit: int = 50,
+    ) -> Iterator[dict]:
+        """Same as get_artist_releases, as plain album objects streamed page by page."""
+        start_date, end_date = release_window(start_date, end_date)
+        items = self.iter_artist_albums(
+            artist_id,
+            include=include,
+            market=market,
+            stop_before=start_date,
+            limit=limit,
         )
-        return df
+        for item in items:
+            if is_release(item, start_date, end_date):
+                yield item
+
+    def iter_artist_albums(
+        self,
+        artist_id: str,
+        include: str = "album,single,appears_on",
+        market: str = "FR",
+        stop_before: date = None,
+        limit: int = 50,
+    ) -> Iterator[dict]:
+        """Lazily iterate over an artist's albums, one page at a time.
+        Without 'stop_before', the whole discography is listed. With it, each include group
+        (listed by Spotify from newest to oldest) is paged only until its releases get older
+        than 'stop_before', so the back catalogue of prolific artists isn't fetched.
+        https://developer.spotify.com/documentation/web-api/reference/get-an-artists-albums"""
+        endpoint = f"artists/{artist_id}/albums"
+        params = {"market": market, "limit": limit, "include_groups": include}
+        page = self._get(endpoint, params={**params, "offset": 0}).json()
+        if stop_before is None or page["next"] is None:
+            # single pass over the combined listing
+            offset = 0
+            while True:
+                yield from page["items"]
+                if page["next"] is None:
+                    return
+                offset += limit
+                page = self._get(endpoint, params={**params, "offset": offset}).json()
+
+        # groups are concatenated in the combined listing: page each one separately,
+        # from where the first page left it
+        for group, items, complete in split_groups(page, include.split(",")):
+            yield from items
+            if complete or (items and older_than(items, stop_before)):
+                continue
+            offset = len(items)
+            while True:
+                page = self._get(
+                    endpoint,
+                    params={**params, "include_groups": group, "offset": offset},
+                ).json()
+                yield from page["items"]
+                if page["next"] is None or older_than(page["items"], stop_before):
+                    break
+                offset += limit
+
+    def get_artist_albums_total(
+        self,
+        artist_id: str,
+        include: str = "album,single,appears_on",
+        market: str = "FR",
+        limit: int = 50,
+    ) -> int:
+        """Number of albums of an artist in the 'include' groups. Its request is the first one
+        of iter_artist_albums (same 'limit'), so the listing that may follow gets it from the cache.
+        """
+        params = {"market": market, "limit": limit, "include_groups": include}
+        r = self._get(f"artists/{artist_id}/albums", params={**params, "offset": 0})
+        return r.json()["total"]
 
     def get_album(self, album_id: str, market: str = "FR") -> dict:
         """Get Spotify catalog information for a single album.
@@ -132,23 +366,51 @@ class Spotify:
         r = self._get(f"albums/{album_id}", params=params)
         return r.json()
 
+    def get_albums(self, albums_ids: list[str], market: str = "FR") -> list[dict]:
+        """Get Spotify catalog information for several albums, 20 per request.
+        Adapted from https://developer.spotify.com/documentation/web-api/reference/get-multiple-albums
+        """
+        albums = []
+        for chunk in n_chunks(albums_ids, chunk_size=20):
+            params = {"ids": ",".join(chunk), "market": market}
+            r = self._get("albums", params=params)
+            albums.extend(r.json()["albums"])
+        return albums
+
+    def get_tracks(self, tracks_ids: list[str], market: str = "FR") -> list[dict]:
+        """Get Spotify catalog information for several tracks, 50 per request.
+        Adapted from https://developer.spotify.com/documentation/web-api/reference/get-several-tracks
+        """
+        tracks = []
+        for chunk in n_chunks(tracks_ids, chunk_size=50):
+            params = {"ids": ",".join(chunk), "market": market}
+            r = self._get("tracks", params=params)
+            tracks.extend(r.json()["tracks"])
+        return tracks
+
     def get_tracks_from_album(
         self, album_id: str, market: str = "FR", limit: int = 50, offset: int = 0
     ) -> pd.DataFrame:
         """Get Spotify catalog information about an album's tracks.
         Conform to original https://developer.spotify.com/documentation/web-api/reference/#/operations/get-an-albums-tracks"""
+        import pandas as pd
+
         params = {"limit": limit, "market": market, "offset": offset}
         r = self._get(f"albums/{album_id}/tracks", params=params)
         return pd.DataFrame(r.json()["items"])
 
-    def _get_tracks_uris_from_album(
+    def iter_album_tracks(
         self, album_id: str, market: str = "FR", limit: int = 50, offset: int = 0
-    ) -> list[str]:
-        """Return tracks uris from an album."""
-        tracks = self.get_tracks_from_album(
-            album_id, market=market, limit=limit, offset=offset
-        )
-        return tracks["uri"].to_list()
+    ) -> Iterator[dict]:
+        """Stream the tracks of an album (simplified track objects) from 'offset', page by page.
+        https://developer.spotify.com/documentation/web-api/reference/get-an-albums-tracks"""
+        params = {"limit": limit, "market": market, "offset": offset}
+        while True:
+            page = self._get(f"albums/{album_id}/tracks", params=params).json()
+            yield from page["items"]
+            if page["next"] is None:
+                return
+            params["offset"] += limit
 
     def get_devices(self) -> dict:
         """Get information about a user’s available devices.
@@ -156,12 +418,83 @@ class Spotify:
         r = self._get("me/player/devices")
         return r.json()
 
-    def add_to_queue(self, tracks_uris: list[str], device_id: str = None):
-        """Add items to the end of the user's current playback queue.
+    def add_to_queue(
+        self,
+        tracks_uris: list[str],
+        device_id: str = None,
+        window: int = 1,
+        market: str = "FR",
+    ) -> list[dict]:
+        """Add items to the end of the user's current playback queue, in order: tracks, episodes,
+        and albums or playlists, queued as their tracks (see iter_queue_uris). The tracks are
+        queued while the next items are being resolved.
+        The API queues one track per request, in the order the requests reach it: 'window' > 1
+        keeps that many in flight, each one being sent once the previous one was, which is
+        faster but can't guarantee the order if one of them gets delayed on the way.
+        Returns the items that couldn't be queued, as {'uri', 'status', 'reason'}.
         Adapted from https://developer.spotify.com/documentation/web-api/reference/#/operations/add-to-queue"""
-        for track_uri in tracks_uris:  # loop through tracks
-            data = {"uri": track_uri, "device_id": device_id}
-            self._post("me/player/queue", json=remove_nones(data))
+
+        def turns() -> Iterator[tuple]:
+            previous = None
+            for uri, track_uri in self.iter_queue_uris(tracks_uris, market):
+                sent = threading.Event()
+                yield uri, track_uri, previous, sent
+                previous = sent
+
+        def queue(turn: tuple) -> dict | None:
+            uri, track_uri, previous, sent = turn
+            try:
+                if track_uri is None:
+                    return {"uri": uri, "status": 404, "reason": "Not found"}
+                if previous is not None:
+                    previous.wait()
+                params = {"uri": track_uri, "device_id": device_id}
+                r = self._post(
+                    "me/player/queue", params=remove_nones(params), on_send=sent.set
+                )
+            except requests.RequestException as e:
+                return {"uri": track_uri, "status": None, "reason": repr(e)}
+            finally:
+                sent.set()
+            if not r.ok:
+                return {"uri": track_uri, "status": r.status_code, "reason": r.text}
+            return None
+
+        # 'map' submits the tracks as 'turns' resolves them, the workers queue them meanwhile
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            return [x for x in executor.map(queue, turns()) if x is not None]
+
+    def iter_queue_uris(
+        self, uris: list[str], market: str = "FR"
+    ) -> Iterator[tuple[str, str | None]]:
+        """Stream (uri, track uri) of the tracks/episodes to queue for 'uris', in order: albums
+        and playlists are replaced by their tracks (track uri None if they weren't found).
+        The albums are fetched 20 per request first (get_albums), their tracks only paged
+        through past the first 50."""
+        albums_ids = [uri_id(uri) for uri in uris if uri.startswith("spotify:album:")]
+        albums = self.get_albums(list(dict.fromkeys(albums_ids)), market=market)
+        albums = {album["id"]: album for album in albums if album is not None}
+        for uri in uris:
+            if uri.startswith("spotify:album:"):
+                album = albums.get(uri_id(uri))
+                if album is None:
+                    yield uri, None
+                    continue
+                page = album["tracks"]
+                tracks = page["items"]
+                if page["next"] is not None:
+                    tracks = itertools.chain(
+                        tracks,
+                        self.iter_album_tracks(album["id"], market, offset=len(tracks)),
+                    )
+            elif uri.startswith("spotify:playlist:"):
+                tracks = self.iter_playlist_items(
+                    uri_id(uri), market, fields="items(track(uri))"
+                )
+            else:
+                tracks = [{"uri": uri}]
+            for track in tracks:
+                yield uri, track["uri"]
 
     def create_playlist(
         self,
@@ -207,23 +540,101 @@ class Spotify:
         self,
         paylist_id: str,
         market: str = "FR",
-        fields: list[str] = None,
-        limit: int = 50,
-        offset: int = 0,
+        fields: str = "items(track(id,name,uri))",
     ) -> pd.DataFrame:
-        """Get full details of the items of a playlist owned by a Spotify user.
-        Conform to original https://developer.spotify.com/documentation/web-api/reference/#/operations/get-playlists-tracks
+        """All the tracks of a playlist, one row each (see iter_playlist_items)."""
+        import pandas as pd
+
+        return pd.DataFrame(
+            list(self.iter_playlist_items(paylist_id, market=market, fields=fields))
+        )
+
+    def iter_playlist_items(
+        self,
+        playlist_id: str,
+        market: str = "FR",
+        fields: str | None = "items(track(id,name,uri))",
+        limit: int = 100,
+        prefetch: bool = True,
+    ) -> Iterator[dict]:
+        """Stream the tracks of a playlist, page by page, skipping unavailable items.
+        'fields' projects the items server-side (None: full objects). With 'prefetch', the
+        next page is requested while the current one is consumed.
+        Adapted from https://developer.spotify.com/documentation/web-api/reference/get-playlists-tracks
         """
-        params = {"market": market, "fields": fields, "limit": limit, "offset": offset}
-        r = self._get(f"playlists/{paylist_id}/tracks", params=remove_nones(params))
-        return pd.json_normalize([x["track"] for x in r.json()["items"]])
+        endpoint = f"playlists/{playlist_id}/tracks"
+
+        def get_page(offset: int) -> dict:
+            params = {
+                "market": market,
+                "fields": f"next,{fields}" if fields else None,
+                "limit": limit,
+                "offset": offset,
+            }
+            return self._get(endpoint, params=remove_nones(params)).json()
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            offset, page = 0, get_page(0)
+            while True:
+                offset += limit
+                last = page["next"] is None
+                following = None
+                if not last and executor is not None:
+                    following = executor.submit(get_page, offset)
+                for item in page["items"]:
+                    if item["track"] is not None:
+                        yield item["track"]
+                if last:
+                    return
+                page = following.result() if following else get_page(offset)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
 
     def update_playlist_items(self, playlist_id: str, tracks_uris: list[str]) -> None:
-        """Either reorder or replace items in a playlist depending on the request's parameters.
+        """Replace the items of a playlist, 100 per request.
         Conform to original https://developer.spotify.com/documentation/web-api/reference/#/operations/reorder-or-replace-playlists-tracks
         """
-        data = {"uris": tracks_uris}
-        self._put(f"playlists/{playlist_id}/tracks", json=data)
+        self._write_playlist(playlist_id, PlaylistDiff(replace=tracks_uris))
+
+    def get_playlist_snapshot(self, playlist_id: str) -> tuple[str, list[str | None]]:
+        """Snapshot id and items' uris (None for unavailable items) of a playlist.
+        Adapted from https://developer.spotify.com/documentation/web-api/reference/get-playlist
+        """
+        params = {"fields": "snapshot_id,tracks(next,items(track(uri)))"}
+        playlist = self._get(f"playlists/{playlist_id}", params=params).json()
+        page = playlist["tracks"]
+        uris = []
+        params = {"fields": "next,items(track(uri))", "limit": 100, "offset": 0}
+        while True:
+            uris.extend(x["track"] and x["track"]["uri"] for x in page["items"])
+            if page["next"] is None:
+                return playlist["snapshot_id"], uris
+            params["offset"] = len(uris)
+            page = self._get(f"playlists/{playlist_id}/tracks", params=params).json()
+
+    def sync_playlist(self, playlist_id: str, tracks_uris: list[str]) -> int:
+        """Make the items of a playlist equal to 'tracks_uris' with as few writes as possible
+        (see lib.playlist_sync); nothing is written if they already are.
+        Return the number of write requests sent."""
+        snapshot_id, current = self.get_playlist_snapshot(playlist_id)
+        diff = diff_playlist(current, tracks_uris)
+        self._write_playlist(playlist_id, diff, snapshot_id)
+        return len(diff)
+
+    def _write_playlist(
+        self, playlist_id: str, diff: PlaylistDiff, snapshot_id: str = None
+    ) -> str | None:
+        """Send the requests of 'diff', each with the snapshot id returned by the previous one."""
+        for method, body in diff.requests():
+            if method != "POST" and snapshot_id is not None:
+                body["snapshot_id"] = snapshot_id
+            r = self._request(method, f"playlists/{playlist_id}/tracks", json=body)
+            if not r.ok:
+                raise Exception(r.status_code, r.reason, r.text)
+            snapshot_id = r.json().get("snapshot_id", snapshot_id)
+        return snapshot_id
 
     def get_user_playlists(
         self, regex: str = None, limit: int = 50, offset: int = 0
@@ -232,21 +643,21 @@ class Spotify:
         Optionally provide 'regex', a regex pattern to filter results.
         Adapted from https://developer.spotify.com/documentation/web-api/reference/get-a-list-of-current-users-playlists
         """
-        params = {"limit": limit, "offset": offset}
-        ls = []
-        while True:
-            r = self._get("me/playlists", params=params)
-            if not r.json()["items"]:
-                break
+        import pandas as pd
 
-            ls.extend(r.json()["items"])
-            params["offset"] += params["limit"]
+        return pd.DataFrame(list(self.iter_user_playlists(regex, limit, offset)))
 
-        df = pd.DataFrame(ls)
-        if regex is not None:
-            df = df.query(f"name.str.contains('{regex}')")
-
-        return df
+    def iter_user_playlists(
+        self, regex: str = None, limit: int = 50, offset: int = 0
+    ) -> Iterator[dict]:
+        """Same as get_user_playlists, as plain playlist objects streamed page by page."""
+        params = {"limit": limit, "offset": offset}
+        while True:
+            items = self._get("me/playlists", params=params).json()["items"]
+            if not items:
+                return
+            yield from match_playlists(items, regex)
+            params["offset"] += limit
 
     def save_albums(self, ids: list[str]) -> requests.Response:
         """Save one or more albums to the current user's 'Your Music' library.
@@ -256,111 +667,35 @@ class Spotify:
         return r
 
     def get_artist_id(self, name: str) -> str:
-        """Try to find an artist's id based on their name."""
-        params = {"q": name.lower(), "type": "artist"}
-        r = self._get("search", params=params)
-        df = pd.json_normalize(r.json()["artists"]["items"])
-        df.sort_values("popularity", ascending=False, inplace=True)
-        df["name"] = df["name"].str.lower()
-        artist_id = df.loc[df["name"] == name.lower(), "id"]
-        if len(artist_id) > 0:
-            return artist_id.iloc[0]
-        else:
-            raise Exception(
-                f"Can't match an artist with this {name=:}, try a different name!"
-            )
-
-    def _get_tracks_popularity(self, tracks_ids: list) -> list[str]:
-        """Return popularity of a list of tracks.
-        Limit is 50 tracks in one batch.
-        Adapted from https://developer.spotify.com/documentation/web-api/reference/get-several-tracks
-        """
-        params = {"ids": ",".join(tracks_ids)}
-        r = self._get("tracks", params=params)
-        return [track["popularity"] for track in r.json()["tracks"]]
-
-    @backoff.on_predicate(backoff.constant, jitter=None, interval=30)
-    def _get_artists_id_from_tracks(
-        self, tracks_ids: list, market: str = "FR"
-    ) -> list[str]:
-        """Return artists' ids featured on a given list of tracks."""
-        params = {"ids": ",".join(tracks_ids), "market": market}
-        r = self._get("tracks", params=params)
-
-        artists_ids = []
-        for track in r.json()["tracks"]:
-            track_artists = []
-            for artist in track["artists"]:
-                track_artists.append(artist["id"])
-            artists_ids.append(track_artists)
-        return artists_ids
-
-    @backoff.on_predicate(backoff.constant, jitter=None, interval=30)
-    def _get_tracks_names(self, tracks_ids: list[str]) -> list[str]:
-        """Get tracks uris from an album"""
-        params = {"ids": ",".join(tracks_ids), "market": "FR"}
-        r = self._get("tracks", params=params)
-
-        tracks_names = []
-        for track in r.json()["tracks"]:
-            tracks_names.append(track["name"])
-        return tracks_names
-
-    def _get_artist_top_songs_helper(
-        self,
-        artist_id: str,
-        include: str = "single",
-        exclude: list[str] = None,
-        country: str = "FR",
-        limit: int = 50,
-    ) -> pd.DataFrame:
-        """Helper function of get_artist_top_songs"""
-        # get albums first
-        params = {"country": country, "limit": limit, "include_groups": include}
-        r = self._get(f"artists/{artist_id}/albums", params=params)
-
-        df = pd.json_normalize(r.json()["items"])
-        if df.empty:
-            return pd.DataFrame()
-
-        df.drop_duplicates(
-            subset=["name", "total_tracks"],
-            keep="first",
-            ignore_index=True,
-            inplace=True,
-        )
-        df["release_date"] = df["release_date"].astype("datetime64[ns]")
-        if exclude is not None:
-            if not isinstance(exclude, list):
-                exclude = [exclude]
-            df = df[~df["id"].isin(exclude)]
-
-        # remove compilation if any
-        df = df[df["album_type"] != "compilation"]
-
-        if df.empty:
-            return pd.DataFrame()
-
-        # get songs from albums now
-        df["track"] = df["id"].apply(self._get_tracks_uris_from_album)
-        df = df.explode("track")
-        df["track_id"] = [track.split(":")[-1] for track in df["track"]]
-
-        # get track's name
-        track_id_chunks = n_chunks(df["track_id"].to_list(), chunk_size=50)
-        tracks_names = []
-        for chunk in track_id_chunks:
-            tracks_names.extend(self._get_tracks_names(chunk))
-        df["track_name"] = tracks_names
-
-        if "appears_on" in include:
-            artists_ids = []
-            for chunk in track_id_chunks:
-                artists_ids.extend(self._get_artists_id_from_tracks(chunk))
-            df["artists_ids"] = [",".join(map(str, ls)) for ls in artists_ids]
-
-            df = df[df["artists_ids"].str.contains(artist_id)]
-        return df
+        """Try to find an artist's id based on their name (case and accents ignored).
+        Only searched if 'artist_ids' doesn't know it yet, or if it's ambiguous."""
+        artist_id = self.artist_ids.get(name)
+        if artist_id is None:
+            artist_id, ambiguous = match_artist(self._search_artists(name), name)
+            if artist_id is None:
+                raise Exception(
+                    f"Can't match an artist with this {name=:}, try a different name!"
+                )
+            self.artist_ids.set(name, artist_id, ambiguous)
+        return artist_id
+
+    def get_artist_ids(self, names: list[str], max_workers: int = 8) -> dict[str, str]:
+        """Name -> id of several artists (see get_artist_id), the unknown ones being searched
+        'max_workers' at a time. Names without a match are left out."""
+        return self.artist_ids.resolve(names, self._search_artists, max_workers)
+
+    def get_playlist_artist_id(self, playlist_id: str, artist_name: str) -> str:
+        """Id of the artist a playlist is named after (e.g. '<artist_name>: Top Songs'),
+        pinned to the playlist once resolved, until it's renamed after another artist."""
+        artist_id = self.artist_ids.playlist(playlist_id, artist_name)
+        if artist_id is None:
+            artist_id = self.get_artist_id(artist_name)
+            self.artist_ids.pin(playlist_id, artist_name, artist_id)
+        return artist_id
+
+    def _search_artists(self, name: str) -> list[dict]:
+        r = self._get("search", params={"q": name.lower(), "type": "artist"})
+        return r.json()["artists"]["items"]
 
     def get_artist_top_songs(
         self,
@@ -376,49 +711,53 @@ class Spotify:
         include: 'appears_on', 'album', 'single' or a combination of any ex. 'appears_on,album,single'
         exclude: albums ids to exclude
         """
-        include_list = include.split(",")
-        df = pd.concat(
-            [
-                self._get_artist_top_songs_helper(
-                    artist_id, include=group, country=country, exclude=exclude
-                )
-                for group in include_list
-            ]
-        )
-        df.drop_duplicates(subset="track_name", inplace=True)
-
-        if method == "recent":
-            return df.nlargest(n, columns="release_date")["track"].to_list()
-        elif method == "popularity":
-            tracks_chunks = n_chunks(df["track_id"].to_list(), 50)
-            popularity = []
-            for chunk in tracks_chunks:
-                popularity.extend(self._get_tracks_popularity(chunk))
-            df["popularity"] = popularity
-            return df.nlargest(n, columns="popularity")["track"].to_list()
-        elif method == "random":
-            return df["track"].sample(n)
-        else:
-            raise ValueError(f"'{method}' is not a valid method, try another one.")
+        # get albums first, the whole discography of every group at once
+        items = self.iter_artist_albums(artist_id, include=include, market=country)
+        albums = prepare_top_albums(items, exclude)
+        if not albums:
+            return []
+
+        # simplified tracks already hold names and artists
+        tracks = [
+            list(self.iter_album_tracks(album["id"], market=country))
+            for album in albums
+        ]
+        candidates = top_songs_candidates(albums, tracks, artist_id)
+
+        if method == "popularity":
+            ids = [x["track_id"] for x in candidates]
+            for x, track in zip(candidates, self.get_tracks(ids, market=country)):
+                # unavailable tracks are None, ranked last as in CatalogMirror
+                x["popularity"] = track["popularity"] if track is not None else 0
+        return rank_top_songs(candidates, n, method)
 
     def add_to_playlist(
         self, playlist_id: str, tracks_uris: str, position: int = 0
     ) -> None:
-        """Add one or more items to a user's playlist.
+        """Add one or more items to a user's playlist, 100 per request, keeping their order.
         Conform to original https://developer.spotify.com/documentation/web-api/reference/add-tracks-to-playlist
         """
-        params = {"uris": ",".join(tracks_uris), "position": position}
-        self._post(f"playlists/{playlist_id}/tracks", params=params)
+        adds = insertions(tracks_uris, position)
+        self._write_playlist(playlist_id, PlaylistDiff(adds=adds))
 
     def update_playlist(
         self,
         playlist_id: str,
         uris: str,
     ) -> None:
-        """Either reorder or replace items in a playlist.
+        """Replace the items of a playlist, 100 per request.
         Adapted from https://developer.spotify.com/documentation/web-api/reference/reorder-or-replace-playlists-tracks
         """
-        params = {"uris": ",".join(uris)}
-        r = self._put(f"playlists/{playlist_id}/tracks", params=params)
-        if not r.ok:
-            raise Exception(r.status_code, r.reason, r.text)
+        self._write_playlist(playlist_id, PlaylistDiff(replace=uris))
+
+
+###########
+# HELPERS #
+###########
+def _cached_response(body: bytes) -> requests.Response:
+    r = requests.Response()
+    r.status_code = 200
+    r.reason = "OK"
+    r._content = body
+    r.headers["Content-Type"] = "application/json"
+    return r
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+LOGGER = logging.getLogger(__name__)
+
+
+def fan_out(
+    func: Callable,
+    items: Iterable,
+    max_workers: int = 8,
+    default: Any = None,
+    logger: logging.Logger = None,
+) -> list:
+    """Call 'func' on every item with at most 'max_workers' calls in flight.
+    Results are returned in the same order as 'items'. A failing call doesn't stop the others:
+    its error is logged (by default to this module's logger) and 'default' is used as its result."""
+    logger = logger or LOGGER
+    name = getattr(func, "__name__", repr(func))
+
+    def safe_call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            logger.error(f"'{name}' failed for {item!r}: {e!r}")
+            return default
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(safe_call, items))
+
+
+async def afan_out(
+    func: Callable,
+    items: Iterable,
+    max_in_flight: int = 8,
+    default: Any = None,
+    logger: logging.Logger = None,
+) -> list:
+    """asyncio version of 'fan_out': 'func' is a coroutine function, at most 'max_in_flight'
+    coroutines are awaited at once and results keep the order of 'items'."""
+    logger = logger or LOGGER
+    name = getattr(func, "__name__", repr(func))
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def safe_call(item):
+        async with semaphore:
+            try:
+                return await func(item)
+            except Exception as e:
+                logger.error(f"'{name}' failed for {item!r}: {e!r}")
+                return default
+
+    return await asyncio.gather(*(safe_call(item) for item in items))
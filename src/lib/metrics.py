@@ -0,0 +1,225 @@
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+# path segments following one of these are ids: 'artists/4Z8W.../albums' -> 'artists/{id}/albums'
+_COLLECTIONS = {
+    "artists",
+    "albums",
+    "tracks",
+    "playlists",
+    "users",
+    "shows",
+    "episodes",
+}
+
+
+def endpoint_template(endpoint: str) -> str:
+    """Endpoint with its ids replaced by '{id}', to aggregate metrics per route."""
+    parts = endpoint.strip("/").split("/")
+    return "/".join(
+        "{id}" if i % 2 and parts[i - 1] in _COLLECTIONS else part
+        for i, part in enumerate(parts)
+    )
+
+
+@dataclass(slots=True)
+class RequestMetric:
+    """One API call, retries included.
+    :cache: 'hit' (no request sent), 'stale' (revalidated, 304 if still valid), 'miss',
+    None if the endpoint isn't cached
+    :waited_s: time spent waiting for the rate limiter, part of 'latency_s'"""
+
+    method: str
+    endpoint: str
+    status: int
+    latency_s: float
+    retries: int = 0
+    bytes: int = 0
+    cache: str | None = None
+    waited_s: float = 0.0
+    timestamp: float = field(default_factory=time.time)
+
+
+class Histogram:
+    """In-memory sink: latencies and counters per route, summarised at the end of a run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: dict[tuple[str, str], dict] = {}
+
+    def record(self, metric: RequestMetric) -> None:
+        with self._lock:
+            route = self._routes.setdefault(
+                (metric.method, metric.endpoint),
+                {"latencies": [], "errors": 0, "retries": 0, "hits": 0, "bytes": 0},
+            )
+            route["latencies"].append(metric.latency_s)
+            route["errors"] += metric.status >= 400
+            route["retries"] += metric.retries
+            route["hits"] += metric.cache == "hit" or metric.status == 304
+            route["bytes"] += metric.bytes
+
+    def close(self) -> None:
+        pass
+
+    def summary(self) -> list[dict]:
+        """One row per route, the most time consuming first."""
+        with self._lock:
+            rows = []
+            for (method, endpoint), route in self._routes.items():
+                latencies = sorted(route["latencies"])
+                rows.append(
+                    {
+                        "route": f"{method} {endpoint}",
+                        "calls": len(latencies),
+                        "errors": route["errors"],
+                        "retries": route["retries"],
+                        "cache_hits": route["hits"],
+                        "mb": round(route["bytes"] / 1024**2, 2),
+                        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+                        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+                        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+                        "total_s": round(sum(latencies), 2),
+                    }
+                )
+        return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+    def table(self) -> str:
+        """'summary' as a plain text table."""
+        rows = self.summary()
+        if not rows:
+            return "no request"
+        columns = list(rows[0])
+        widths = {c: max(len(c), *(len(str(row[c])) for row in rows)) for c in columns}
+        lines = [
+            "  ".join(
+                (str(row[c]).ljust if c == "route" else str(row[c]).rjust)(widths[c])
+                for c in columns
+            )
+            for row in [dict(zip(columns, columns)), *rows]
+        ]
+        return "\n".join(lines)
+
+
+class JsonLinesSink:
+    """Append every metric to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def record(self, metric: RequestMetric) -> None:
+        line = json.dumps(asdict(metric))
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusTextfile(Histogram):
+    """Write the run's metrics to 'path', in the format of node_exporter's textfile collector.
+    The file is replaced on 'close', so the exporter never reads a partial file."""
+
+    def __init__(self, path: str, job: str = None):
+        super().__init__()
+        self.path = path
+        self.labels = f'job="{job}",' if job else ""
+        self._statuses: dict[tuple[str, str, int], int] = {}
+
+    def record(self, metric: RequestMetric) -> None:
+        super().record(metric)
+        key = (metric.method, metric.endpoint, metric.status)
+        with self._lock:
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def close(self) -> None:
+        lines = [
+            "# HELP spotify_requests_total Spotify Web API calls.",
+            "# TYPE spotify_requests_total counter",
+        ]
+        with self._lock:
+            for (method, endpoint, status), count in sorted(self._statuses.items()):
+                labels = f'{self.labels}method="{method}",endpoint="{endpoint}",status="{status}"'
+                lines.append(f"spotify_requests_total{{{labels}}} {count}")
+
+            summary = [
+                "# HELP spotify_request_duration_seconds Latency of the calls, retries included.",
+                "# TYPE spotify_request_duration_seconds summary",
+            ]
+            counters = {
+                name: [f"# TYPE spotify_{name}_total counter"]
+                for name in ("retries", "cache_hits", "response_bytes")
+            }
+            for (method, endpoint), route in sorted(self._routes.items()):
+                labels = f'{self.labels}method="{method}",endpoint="{endpoint}"'
+                latencies = sorted(route["latencies"])
+                for q in (0.5, 0.95, 0.99):
+                    summary.append(
+                        f'spotify_request_duration_seconds{{{labels},quantile="{q}"}} '
+                        f"{_percentile(latencies, q * 100):.6f}"
+                    )
+                summary.append(
+                    f"spotify_request_duration_seconds_sum{{{labels}}} {sum(latencies):.6f}"
+                )
+                summary.append(
+                    f"spotify_request_duration_seconds_count{{{labels}}} {len(latencies)}"
+                )
+                for name, value in (
+                    ("retries", route["retries"]),
+                    ("cache_hits", route["hits"]),
+                    ("response_bytes", route["bytes"]),
+                ):
+                    counters[name].append(f"spotify_{name}_total{{{labels}}} {value}")
+        lines += summary + [line for lines_ in counters.values() for line in lines_]
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.path)
+
+
+class Metrics:
+    """Dispatch the metrics of every API call to the sinks (default: a Histogram)."""
+
+    def __init__(self, *sinks):
+        self.sinks = list(sinks) or [Histogram()]
+        self._lock = threading.Lock()
+        self.requests = 0  # calls that reached the API, i.e. not answered by the cache
+
+    def record(self, method: str, endpoint: str, status: int, started: float, **kwargs):
+        """Record a call started at 'started' (time.perf_counter()) and just finished."""
+        metric = RequestMetric(
+            method=method,
+            endpoint=endpoint_template(endpoint),
+            status=status,
+            latency_s=time.perf_counter() - started,
+            **kwargs,
+        )
+        with self._lock:
+            self.requests += metric.cache != "hit"
+        for sink in self.sinks:
+            sink.record(metric)
+
+    def table(self) -> str:
+        """Summary table of the first Histogram sink."""
+        for sink in self.sinks:
+            if isinstance(sink, Histogram):
+                return sink.table()
+        return ""
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def _percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted 'values'."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
@@ -0,0 +1,447 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from lib.concurrency import fan_out
+from lib.payloads import (
+    ALBUM_GROUPS_ORDER,
+    full_date,
+    is_release,
+    prepare_top_albums,
+    rank_top_songs,
+    release_window,
+    top_songs_candidates,
+)
+from lib.utils import n_chunks
+
+if TYPE_CHECKING:
+    from lib.client import Spotify
+
+# groups of an artist's albums kept in the mirror
+MIRRORED_GROUPS = "album,single,appears_on"
+
+_ALBUM_COLUMNS = (
+    "album_id, name, album_type, release_date, release_date_precision, "
+    "total_tracks, uri, artists"
+)
+
+
+class CatalogMirror:
+    """SQLite copy of the discographies of some artists (albums, their tracks with ISRC and
+    popularity), indexed by artist, release date and ISRC, answering the same queries as
+    Spotify.iter_artist_releases and Spotify.get_artist_top_songs without any request.
+    'sync' updates it incrementally: an artist's releases are only listed if their number
+    changed, and then only those newer than the latest one known; only the albums not mirrored
+    yet are fetched, and the popularity of tracks is refreshed once older than 'popularity_age'.
+    Use path=':memory:' for a mirror living only as long as the process."""
+
+    def __init__(self, path: str = ".cache/catalog.sqlite"):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS artists ("
+            "artist_id TEXT PRIMARY KEY, name TEXT, albums_total INTEGER, synced_at REAL);"
+            "CREATE TABLE IF NOT EXISTS albums ("
+            "album_id TEXT PRIMARY KEY, name TEXT, album_type TEXT, release_date TEXT, "
+            "release_date_precision TEXT, total_tracks INTEGER, uri TEXT, artists TEXT);"
+            "CREATE INDEX IF NOT EXISTS albums_release_date ON albums (release_date);"
+            "CREATE TABLE IF NOT EXISTS artist_albums ("
+            "artist_id TEXT, album_id TEXT, album_group TEXT, "
+            "PRIMARY KEY (artist_id, album_id));"
+            "CREATE INDEX IF NOT EXISTS artist_albums_album ON artist_albums (album_id);"
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "track_id TEXT PRIMARY KEY, album_id TEXT, name TEXT, uri TEXT, "
+            "disc_number INTEGER, track_number INTEGER, artists TEXT, isrc TEXT, "
+            "popularity INTEGER, popularity_at REAL);"
+            "CREATE INDEX IF NOT EXISTS tracks_album ON tracks "
+            "(album_id, disc_number, track_number);"
+            "CREATE INDEX IF NOT EXISTS tracks_isrc ON tracks (isrc);"
+        )
+        self._synced: set[str] = set()
+
+    ###########
+    # QUERIES #
+    ###########
+    def releases(
+        self,
+        artist_id: str,
+        start_date: date = None,
+        end_date: date = None,
+        include: str = MIRRORED_GROUPS,
+    ) -> list[dict]:
+        """Same as Spotify.iter_artist_releases (default: last 7 days), from the mirror."""
+        start_date, end_date = release_window(start_date, end_date)
+        albums = self.albums(
+            artist_id,
+            include,
+            "AND a.release_date BETWEEN ? AND ?",
+            (start_date.isoformat(), end_date.isoformat()),
+        )
+        return [x for x in albums if is_release(x, start_date, end_date)]
+
+    def top_songs(
+        self,
+        artist_id: str,
+        n: int = 50,
+        include: str = "single,album,appears_on",
+        method: str = "popularity",
+        exclude: list[str] = None,
+    ) -> list[str]:
+        """Same as Spotify.get_artist_top_songs, from the mirror."""
+        albums = prepare_top_albums(self.albums(artist_id, include), exclude)
+        if not albums:
+            return []
+        tracks = self.tracks([album["id"] for album in albums])
+        candidates = top_songs_candidates(
+            albums, [tracks.get(album["id"], []) for album in albums], artist_id
+        )
+        if method == "popularity":
+            popularity = {
+                track["id"]: track["popularity"]
+                for album_tracks in tracks.values()
+                for track in album_tracks
+            }
+            for x in candidates:
+                x["popularity"] = popularity[x["track_id"]] or 0
+        return rank_top_songs(candidates, n, method)
+
+    def albums(
+        self,
+        artist_id: str,
+        include: str = MIRRORED_GROUPS,
+        where: str = "",
+        params: tuple = (),
+    ) -> list[dict]:
+        """Album objects of an artist (with their 'album_group'), in the order of the API's
+        listing: group by group, newest first. 'where' adds conditions on 'a' (albums)."""
+        groups = include.split(",")
+        order = " ".join(f"WHEN ? THEN {i}" for i in range(len(ALBUM_GROUPS_ORDER)))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_ALBUM_COLUMNS.replace('album_id', 'a.album_id')}, aa.album_group "
+                "FROM artist_albums aa JOIN albums a ON a.album_id = aa.album_id "
+                f"WHERE aa.artist_id = ? AND aa.album_group IN ({','.join('?' * len(groups))}) "
+                f"{where} ORDER BY CASE aa.album_group {order} END, a.release_date DESC",
+                (artist_id, *groups, *params, *ALBUM_GROUPS_ORDER),
+            ).fetchall()
+        return [
+            {
+                "id": row[0],
+                "name": row[1],
+                "album_type": row[2],
+                "release_date": row[3],
+                "release_date_precision": row[4],
+                "total_tracks": row[5],
+                "uri": row[6],
+                "artists": json.loads(row[7]),
+                "album_group": row[8],
+            }
+            for row in rows
+        ]
+
+    def tracks(self, album_ids: list[str]) -> dict[str, list[dict]]:
+        """Album id -> its tracks (with 'isrc' and 'popularity'), in the album's order."""
+        tracks = {}
+        for chunk in n_chunks(album_ids, chunk_size=500):
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT track_id, album_id, name, uri, disc_number, track_number, "
+                    "artists, isrc, popularity FROM tracks "
+                    f"WHERE album_id IN ({','.join('?' * len(chunk))}) "
+                    "ORDER BY album_id, disc_number, track_number",
+                    chunk,
+                ).fetchall()
+            for row in rows:
+                tracks.setdefault(row[1], []).append(
+                    {
+                        "id": row[0],
+                        "name": row[2],
+                        "uri": row[3],
+                        "disc_number": row[4],
+                        "track_number": row[5],
+                        "artists": json.loads(row[6]),
+                        "isrc": row[7],
+                        "popularity": row[8],
+                    }
+                )
+        return tracks
+
+    def stats(self) -> dict:
+        """Number of artists, albums and tracks mirrored."""
+        with self._lock:
+            return {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("artists", "albums", "tracks")
+            }
+
+    ########
+    # SYNC #
+    ########
+    def sync(
+        self,
+        spotify: Spotify,
+        artist_ids: list[str],
+        full: bool = False,
+        popularity_age: float = 7 * 24 * 3600,
+        max_workers: int = 8,
+        market: str = "FR",
+        logger: logging.Logger = None,
+    ) -> dict:
+        """Update the discographies of 'artist_ids', 'max_workers' requests at a time.
+        An artist whose number of releases didn't change costs one request, otherwise only its
+        releases newer than the latest one known are listed. With 'full', whole discographies
+        are listed and the albums no longer in them dropped.
+        Artists already synced by this mirror are skipped. An artist whose listing (or one of
+        whose new albums) fails is logged and left as is. Returns the number of records changed and requests sent."""
+        requests = spotify.metrics.requests
+        artist_ids = [x for x in dict.fromkeys(artist_ids) if x not in self._synced]
+        known = {} if full else self._known_artists(artist_ids)
+
+        def list_albums(artist_id: str) -> tuple[int, list[dict]]:
+            """Number of releases of an artist, and those to store (new ones at least)."""
+            total, latest = known.get(artist_id, (None, None))
+            stop_before = None
+            if latest is not None:
+                total = spotify.get_artist_albums_total(
+                    artist_id, include=MIRRORED_GROUPS, market=market
+                )
+                if total == known[artist_id][0]:
+                    return total, []
+                stop_before = date.fromisoformat(latest)
+            items = list(
+                spotify.iter_artist_albums(
+                    artist_id,
+                    include=MIRRORED_GROUPS,
+                    market=market,
+                    stop_before=stop_before,
+                )
+            )
+            return total if stop_before else len(items), items
+
+        listings = fan_out(
+            list_albums, artist_ids, max_workers, default=None, logger=logger
+        )
+        listings = {
+            artist_id: listing
+            for artist_id, listing in zip(artist_ids, listings)
+            if listing is not None
+        }
+
+        # new albums, fetched 20 per request with their first 50 tracks
+        listed = {item["id"] for _, items in listings.values() for item in items}
+        new_ids = sorted(listed - self._known_albums(listed))
+        chunks = fan_out(
+            lambda chunk: spotify.get_albums(chunk, market=market),
+            n_chunks(new_ids, chunk_size=20),
+            max_workers,
+            default=[],
+            logger=logger,
+        )
+        albums = [album for chunk in chunks for album in chunk if album is not None]
+        longer = [album for album in albums if album["tracks"]["next"] is not None]
+        rest = fan_out(
+            lambda album: list(
+                spotify.iter_album_tracks(
+                    album["id"], market, offset=len(album["tracks"]["items"])
+                )
+            ),
+            longer,
+            max_workers,
+            default=[],
+            logger=logger,
+        )
+        album_tracks = {album["id"]: album["tracks"]["items"] for album in albums}
+        for album, items in zip(longer, rest):
+            album_tracks[album["id"]] = album_tracks[album["id"]] + items
+        # artists with albums that couldn't be fetched are left for the next sync
+        missing = set(new_ids) - album_tracks.keys()
+        listings = {
+            artist_id: (total, items)
+            for artist_id, (total, items) in listings.items()
+            if not any(item["id"] in missing for item in items)
+        }
+
+        # ISRC and popularity of the new tracks, and of those whose popularity got old
+        new_tracks = [track["id"] for items in album_tracks.values() for track in items]
+        stale = self._stale_tracks(list(listings), time.time() - popularity_age)
+        chunks = fan_out(
+            lambda chunk: spotify.get_tracks(chunk, market=market),
+            n_chunks(new_tracks + stale, chunk_size=50),
+            max_workers,
+            default=[],
+            logger=logger,
+        )
+        full_tracks = {
+            track["id"]: track for chunk in chunks for track in chunk if track
+        }
+
+        counts = self._write(spotify, listings, albums, album_tracks, full_tracks, full)
+        self._synced.update(listings)
+        return {
+            "artists": len(listings),
+            **counts,
+            "requests": spotify.metrics.requests - requests,
+        }
+
+    def _known_artists(
+        self, artist_ids: list[str]
+    ) -> dict[str, tuple[int, str | None]]:
+        """Artist id -> (number of releases, date of the latest one) of the artists synced."""
+        known = {}
+        for chunk in n_chunks(artist_ids, chunk_size=500):
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT ar.artist_id, ar.albums_total, MAX(a.release_date) "
+                    "FROM artists ar "
+                    "LEFT JOIN artist_albums aa ON aa.artist_id = ar.artist_id "
+                    "LEFT JOIN albums a ON a.album_id = aa.album_id "
+                    f"WHERE ar.artist_id IN ({','.join('?' * len(chunk))}) "
+                    "GROUP BY ar.artist_id",
+                    chunk,
+                ).fetchall()
+            known.update(
+                (artist_id, (total, full_date(day) if day else None))
+                for artist_id, total, day in rows
+            )
+        return known
+
+    def _known_albums(self, album_ids: set[str]) -> set[str]:
+        known = set()
+        for chunk in n_chunks(list(album_ids), chunk_size=500):
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT album_id FROM albums "
+                    f"WHERE album_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            known.update(row[0] for row in rows)
+        return known
+
+    def _stale_tracks(self, artist_ids: list[str], before: float) -> list[str]:
+        """Tracks of the artists' albums whose popularity was fetched before 'before'."""
+        stale = []
+        for chunk in n_chunks(artist_ids, chunk_size=500):
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT DISTINCT t.track_id FROM artist_albums aa "
+                    "JOIN tracks t ON t.album_id = aa.album_id "
+                    f"WHERE aa.artist_id IN ({','.join('?' * len(chunk))}) "
+                    "AND t.popularity_at < ?",
+                    (*chunk, before),
+                ).fetchall()
+            stale += [row[0] for row in rows]
+        return stale
+
+    def _write(
+        self,
+        spotify: Spotify,
+        listings: dict[str, tuple[int, list[dict]]],
+        albums: list[dict],
+        album_tracks: dict[str, list[dict]],
+        full_tracks: dict[str, dict],
+        full: bool,
+    ) -> dict:
+        """Store a sync's results in one transaction, return the number of records changed."""
+        now = time.time()
+        counts = dict.fromkeys(
+            ("albums_added", "albums_removed", "tracks_added", "tracks_updated"), 0
+        )
+        with self._lock, self._conn:
+            conn = self._conn
+            for artist_id, (total, items) in listings.items():
+                artist = spotify.artists.get(artist_id)
+                conn.execute(
+                    "INSERT INTO artists VALUES (?, ?, ?, ?) ON CONFLICT (artist_id) DO "
+                    "UPDATE SET name = COALESCE(excluded.name, name), "
+                    "albums_total = excluded.albums_total, synced_at = excluded.synced_at",
+                    (artist_id, artist.name if artist else None, total, now),
+                )
+                if full:
+                    conn.execute(
+                        "DELETE FROM artist_albums WHERE artist_id = ?", (artist_id,)
+                    )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO artist_albums VALUES (?, ?, ?)",
+                    [(artist_id, item["id"], item["album_group"]) for item in items],
+                )
+
+            for album in albums:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO albums ({_ALBUM_COLUMNS}) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        album["id"],
+                        album["name"],
+                        album["album_type"],
+                        album["release_date"],
+                        album.get("release_date_precision"),
+                        album["total_tracks"],
+                        album["uri"],
+                        json.dumps(
+                            [
+                                {"id": a["id"], "name": a["name"]}
+                                for a in album["artists"]
+                            ]
+                        ),
+                    ),
+                )
+                counts["albums_added"] += 1
+                for track in album_tracks[album["id"]]:
+                    full_track = full_tracks.get(track["id"], {})
+                    conn.execute(
+                        "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            track["id"],
+                            album["id"],
+                            track["name"],
+                            track["uri"],
+                            track.get("disc_number", 1),
+                            track["track_number"],
+                            json.dumps(
+                                [
+                                    {"id": a["id"], "name": a["name"]}
+                                    for a in track["artists"]
+                                ]
+                            ),
+                            full_track.get("external_ids", {}).get("isrc"),
+                            full_track.get("popularity"),
+                            now if full_track else 0,
+                        ),
+                    )
+                    counts["tracks_added"] += 1
+
+            new = {track["id"] for items in album_tracks.values() for track in items}
+            for track_id, track in full_tracks.items():
+                if track_id in new:
+                    continue
+                counts["tracks_updated"] += conn.execute(
+                    "UPDATE tracks SET popularity = ?, popularity_at = ? "
+                    "WHERE track_id = ? AND popularity IS NOT ?",
+                    (track["popularity"], now, track_id, track["popularity"]),
+                ).rowcount
+                conn.execute(
+                    "UPDATE tracks SET popularity_at = ? WHERE track_id = ?",
+                    (now, track_id),
+                )
+
+            # albums no artist lists anymore
+            orphans = (
+                "SELECT album_id FROM albums "
+                "WHERE album_id NOT IN (SELECT album_id FROM artist_albums)"
+            )
+            conn.execute(f"DELETE FROM tracks WHERE album_id IN ({orphans})")
+            counts["albums_removed"] = conn.execute(
+                f"DELETE FROM albums WHERE album_id IN ({orphans})"
+            ).rowcount
+        return counts
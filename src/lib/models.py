@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+
+from lib.utils import fold, track_title
+
+
+@dataclass(slots=True, frozen=True)
+class Artist:
+    """Compact artist record, built from any Spotify (simplified or full) artist object."""
+
+    id: str
+    name: str
+    genres: tuple[str, ...] = ()
+    popularity: int | None = None
+
+    @classmethod
+    def from_json(cls, item: dict) -> "Artist":
+        return cls(
+            id=item["id"],
+            name=item["name"],
+            genres=tuple(item.get("genres", ())),
+            popularity=item.get("popularity"),
+        )
+
+
+class ArtistIndex:
+    """In-process index of the artists seen during a run, by id and by (lowercased) name."""
+
+    def __init__(self, artists: list[Artist] = None):
+        self.by_id: dict[str, Artist] = {}
+        self.by_name: dict[str, Artist] = {}
+        self.followed: list[Artist] | None = None  # set by get_favorite_artists
+        self.add(artists or [])
+
+    def add(self, artists: list[Artist]) -> None:
+        for artist in artists:
+            self.by_id[artist.id] = artist
+            self.by_name.setdefault(artist.name.lower(), artist)
+
+    def fork(self) -> "ArtistIndex":
+        """Index sharing the artists of this one, with its own 'followed' (e.g. another user's)."""
+        index = ArtistIndex()
+        index.by_id, index.by_name = self.by_id, self.by_name
+        return index
+
+    def get(self, artist_id: str) -> Artist | None:
+        return self.by_id.get(artist_id)
+
+    def find(self, name: str) -> Artist | None:
+        return self.by_name.get(name.lower())
+
+    def __contains__(self, artist_id: str) -> bool:
+        return artist_id in self.by_id
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+
+class TrackIndex:
+    """Hash index of tracks by ISRC and by title (folded, version mentions like 'Remastered'
+    or 'Clean' removed) + primary artist: a track is in it if either of its keys is, so the
+    clean/explicit or remastered versions of a song match it, not the songs of other artists
+    with the same title.
+    Tracks are records with 'name', 'artists' (names, primary first) and 'isrc' (or None)."""
+
+    def __init__(self, tracks: list[dict] = None):
+        self.keys: set[tuple[str, ...]] = set()
+        for track in tracks or []:
+            self.add(track)
+
+    @staticmethod
+    def track_keys(track: dict) -> list[tuple[str, ...]]:
+        artist = fold(track["artists"][0]) if track["artists"] else ""
+        keys = [("title", artist, track_title(track["name"]))]
+        if track.get("isrc"):
+            keys.append(("isrc", track["isrc"].upper()))
+        return keys
+
+    def add(self, track: dict) -> bool:
+        """Add a track, False if it (or another version of it) already was."""
+        keys = self.track_keys(track)
+        new = self.keys.isdisjoint(keys)
+        self.keys.update(keys)
+        return new
+
+    def has_title(self, name: str, artist: str) -> bool:
+        """Whether a track of 'artist' titled 'name' is in, e.g. the track of a single."""
+        return ("title", fold(artist), track_title(name)) in self.keys
+
+    def __contains__(self, track: dict) -> bool:
+        return not self.keys.isdisjoint(self.track_keys(track))
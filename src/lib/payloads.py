@@ -0,0 +1,122 @@
+import random
+import re
+from datetime import date, datetime, timedelta, timezone
+
+# order of the groups in the API's listing of an artist's albums
+ALBUM_GROUPS_ORDER = ("album", "single", "compilation", "appears_on")
+
+
+def uri_id(uri: str) -> str:
+    """'spotify:album:<id>' -> '<id>'"""
+    return uri.rsplit(":", 1)[-1]
+
+
+def release_window(start_date: date = None, end_date: date = None) -> tuple:
+    """Default release window: the last 7 days."""
+    today = datetime.now(timezone.utc).date()
+    if start_date is None:
+        start_date = today - timedelta(days=7)
+    if end_date is None:
+        end_date = today
+    return start_date, end_date
+
+
+def split_groups(page: dict, groups: list[str]) -> list[tuple[str, list[dict], bool]]:
+    """Split a first page of an artist's albums listed with several include groups into
+    (group, its items on the page, whether they are all of them), in the order of 'groups'.
+    The groups are concatenated in ALBUM_GROUPS_ORDER: only the group of the page's last item
+    may go on in the next pages, those after it aren't listed yet."""
+    items = page["items"]
+    last = items[-1]["album_group"] if items else None
+    split = []
+    for group in groups:
+        complete = page["next"] is None or (
+            last in ALBUM_GROUPS_ORDER
+            and group in ALBUM_GROUPS_ORDER
+            and ALBUM_GROUPS_ORDER.index(group) < ALBUM_GROUPS_ORDER.index(last)
+        )
+        split.append((group, [x for x in items if x["album_group"] == group], complete))
+    return split
+
+
+def older_than(items: list[dict], day: date) -> bool:
+    """Whether a page (sorted from newest to oldest) reached releases older than 'day'."""
+    return bool(items) and items[-1]["release_date"] < day.isoformat()
+
+
+def is_release(item: dict, start_date: date, end_date: date) -> bool:
+    """Whether an album was released between 'start_date' and 'end_date',
+    compilations and 'Various Artists' albums excluded."""
+    return (
+        start_date.isoformat() <= item["release_date"] <= end_date.isoformat()
+        and item["album_type"] != "compilation"
+        and item["artists"][0]["name"] != "Various Artists"
+    )
+
+
+def match_playlists(items: list[dict], regex: str = None) -> list[dict]:
+    if regex is None:
+        return items
+    return [item for item in items if re.search(regex, item["name"])]
+
+
+def prepare_top_albums(items: list[dict], exclude: list[str] = None) -> list[dict]:
+    """Dedupe an artist's albums and drop excluded ones and compilations."""
+    if exclude is not None and not isinstance(exclude, list):
+        exclude = [exclude]
+    excluded = set(exclude or ())
+    albums, seen = [], set()
+    for item in items:
+        key = (item["name"], item["total_tracks"])
+        if key in seen:
+            continue
+        seen.add(key)
+        if item["id"] not in excluded and item["album_type"] != "compilation":
+            albums.append(item)
+    return albums
+
+
+def top_songs_candidates(
+    albums: list[dict], tracks: list[list[dict]], artist_id: str
+) -> list[dict]:
+    """One record per track of 'albums' ('tracks': their simplified tracks, in the same order),
+    without the songs of other artists on 'appears_on' albums and deduped by name."""
+    candidates, names = [], set()
+    for album, album_tracks in zip(albums, tracks):
+        for track in album_tracks:
+            if album["album_group"] == "appears_on" and not any(
+                artist["id"] == artist_id for artist in track["artists"]
+            ):
+                continue
+            if track["name"] in names:
+                continue
+            names.add(track["name"])
+            candidates.append(
+                {
+                    "track": track["uri"],
+                    "track_id": track["id"],
+                    "track_name": track["name"],
+                    "release_date": full_date(album["release_date"]),
+                    "album_group": album["album_group"],
+                }
+            )
+    return candidates
+
+
+def full_date(release_date: str) -> str:
+    """'2020' and '2020-05' (release_date_precision: year, month) as '2020-01-01', '2020-05-01'."""
+    return (release_date + "-01-01")[:10]
+
+
+def rank_top_songs(candidates: list[dict], n: int, method: str) -> list[str]:
+    """Top n track uris of 'candidates' (see top_songs_candidates), ranked by 'method'.
+    Ties keep the candidates' order."""
+    if method in ("recent", "popularity"):
+        column = "release_date" if method == "recent" else "popularity"
+        ranked = sorted(candidates, key=lambda x: x[column], reverse=True)
+        return [x["track"] for x in ranked[:n]]
+    elif method == "random":
+        tracks = [x["track"] for x in candidates]
+        return random.sample(tracks, min(n, len(tracks)))
+    else:
+        raise ValueError(f"'{method}' is not a valid method, try another one.")
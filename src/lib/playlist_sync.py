@@ -0,0 +1,129 @@
+import bisect
+from collections import Counter
+from dataclasses import dataclass, field
+
+CHUNK_SIZE = 100  # max items per playlist write
+
+
+@dataclass(slots=True)
+class PlaylistDiff:
+    """Writes turning a playlist's items into a target list of uris, applied in this order:
+    :removes: uris removed (the API removes every occurrence of a uri)
+    :moves: (range_start, insert_before) of the items moved, one at a time
+    :adds: (position, uris) inserted, left to right
+    :replace: the target itself, when replacing the playlist takes fewer requests"""
+
+    removes: list[str] = field(default_factory=list)
+    moves: list[tuple[int, int]] = field(default_factory=list)
+    adds: list[tuple[int, list[str]]] = field(default_factory=list)
+    replace: list[str] | None = None
+
+    def __len__(self) -> int:
+        """Number of write requests."""
+        return len(self.requests())
+
+    def requests(self) -> list[tuple[str, dict]]:
+        """(method, JSON body) of the requests to send to 'playlists/{id}/tracks'.
+        The caller adds the playlist's latest 'snapshot_id' to the PUT and DELETE bodies."""
+        if self.replace is not None:
+            chunks = _chunks(self.replace) or [[]]
+            return [("PUT", {"uris": chunks[0]})] + [
+                ("POST", {"uris": chunk}) for chunk in chunks[1:]
+            ]
+        requests = [
+            ("DELETE", {"tracks": [{"uri": uri} for uri in chunk]})
+            for chunk in _chunks(self.removes)
+        ]
+        requests += [
+            ("PUT", {"range_start": start, "insert_before": before, "range_length": 1})
+            for start, before in self.moves
+        ]
+        requests += [("POST", {"uris": uris, "position": i}) for i, uris in self.adds]
+        return requests
+
+
+def diff_playlist(current: list[str | None], target: list[str]) -> PlaylistDiff:
+    """Cheapest PlaylistDiff from 'current' (None: unavailable item) to 'target':
+    an empty diff if they are equal, a replacement if the diff would take more requests."""
+    if current == target:
+        return PlaylistDiff()
+    replace = PlaylistDiff(replace=list(target))
+    if None in current:
+        return replace
+
+    # remove the uris absent from the target, and those with extra duplicates
+    wanted = Counter(target)
+    counts = Counter(current)
+    removes = [uri for uri in counts if counts[uri] > wanted[uri]]
+    removed = set(removes)
+    kept = [uri for uri in current if uri not in removed]
+
+    # kept items, as positions in the target: their n-th occurrence maps to the n-th one there
+    occurrences: dict[str, list[int]] = {}
+    for i, uri in enumerate(target):
+        occurrences.setdefault(uri, []).append(i)
+    seen = Counter()
+    state = []
+    for uri in kept:
+        state.append(occurrences[uri][seen[uri]])
+        seen[uri] += 1
+
+    # move the items out of a longest increasing subsequence, each after its predecessor
+    moves = []
+    placed = sorted(state[i] for i in _longest_increasing(state))
+    for position in sorted(set(state) - set(placed)):
+        start = state.index(position)
+        k = bisect.bisect_left(placed, position)
+        before = state.index(placed[k - 1]) + 1 if k else 0
+        moves.append((start, before))
+        state.pop(start)
+        state.insert(before - (before > start), position)
+        placed.insert(k, position)
+
+    # then insert the missing items, run by run
+    adds = []
+    present = set(state)
+    run = []
+    for i, uri in enumerate(target + [None]):
+        if i < len(target) and i not in present:
+            run.append(uri)
+            continue
+        adds += insertions(run, position=i - len(run))
+        run = []
+
+    diff = PlaylistDiff(removes=removes, moves=moves, adds=adds)
+    return diff if len(diff) <= len(replace) else replace
+
+
+def insertions(uris: list[str], position: int = 0) -> list[tuple[int, list[str]]]:
+    """'adds' inserting 'uris' at 'position' in their order, CHUNK_SIZE per request."""
+    return [(position + k * CHUNK_SIZE, chunk) for k, chunk in enumerate(_chunks(uris))]
+
+
+def _chunks(ls: list) -> list[list]:
+    return [ls[i : i + CHUNK_SIZE] for i in range(0, len(ls), CHUNK_SIZE)]
+
+
+def _longest_increasing(values: list[int]) -> list[int]:
+    """Indices of a longest strictly increasing subsequence of 'values' (patience sorting)."""
+    tails: list[
+        int
+    ] = []  # tails[k]: index of the smallest tail of a subsequence of length k+1
+    tail_values: list[int] = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        k = bisect.bisect_left(tail_values, value)
+        if k:
+            previous[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tail_values.append(value)
+        else:
+            tails[k] = i
+            tail_values[k] = value
+    indices = []
+    i = tails[-1] if tails else -1
+    while i != -1:
+        indices.append(i)
+        i = previous[i]
+    return indices[::-1]
@@ -0,0 +1,120 @@
+import asyncio
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class RateLimiter:
+    """Thread-safe token bucket shared by every request of a client (sync or async).
+    The rate adapts to the API: it is halved when we get throttled, once per throttle window
+    (the concurrent 429s of a burst count as one), and grows back by a fraction of itself
+    after each successful request. A 'Retry-After' pause applies to every caller at once."""
+
+    _COOLDOWN = 1.0  # minimum throttle window (s): 429s of requests already in flight
+    _RECOVERY = 1.05  # rate multiplier after each successful request
+
+    def __init__(self, rate: float = 20.0, burst: int = 20, min_rate: float = 1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._window_until = 0.0
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._requests = 0
+        self._throttled = 0
+        self._waited = 0.0
+
+    def _take(self) -> float:
+        """Take a token if one is available and return 0, else return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._requests += 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def _record_wait(self, waited: float) -> None:
+        with self._lock:
+            self._waited += waited
+
+    def acquire(self) -> float:
+        """Block until a request may be sent, return the time waited (in seconds)."""
+        waited = 0.0
+        while wait := self._take():
+            time.sleep(wait)
+            waited += wait
+        self._record_wait(waited)
+        return waited
+
+    async def acquire_async(self) -> float:
+        """Same as 'acquire' without blocking the event loop."""
+        waited = 0.0
+        while wait := self._take():
+            await asyncio.sleep(wait)
+            waited += wait
+        self._record_wait(waited)
+        return waited
+
+    def throttle(self, retry_after: float) -> None:
+        """Pause every caller for 'retry_after' seconds and slow down the rate,
+        unless we are still in the window of a previous throttle."""
+        with self._lock:
+            self._throttled += 1
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + retry_after)
+            if now < self._window_until:
+                return
+            self._window_until = now + max(retry_after, self._COOLDOWN)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+
+    def success(self) -> None:
+        """Let the rate recover after a request that wasn't throttled."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate * self._RECOVERY)
+
+    def stats(self) -> dict:
+        """Throughput and waiting statistics since the limiter was created."""
+        with self._lock:
+            elapsed = time.monotonic() - self._start
+            return {
+                "requests": self._requests,
+                "throttled": self._throttled,
+                "waited_s": round(self._waited, 2),
+                "throughput_rps": round(self._requests / elapsed, 2)
+                if elapsed
+                else 0.0,
+                "current_rate": round(self.rate, 2),
+            }
+
+
+def retry_after(value: str | None, default: float) -> float:
+    """Seconds to wait from a 'Retry-After' header: delay in seconds or HTTP-date.
+    'default' if the header is missing or malformed."""
+    if value is None:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return default
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        seconds = (when - datetime.now(timezone.utc)).total_seconds()
+    return max(0.0, seconds) if math.isfinite(seconds) else default
@@ -1,19 +1,150 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
 import requests
 
+from lib.metrics import Metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: the token file isn't locked between processes
+    fcntl = None
+
 
 class Refresh:
     """Refresh Spotify Token"""
 
-    def __init__(self, refresh_token, base_64):
+    _URL = "https://accounts.spotify.com/api/token"
+
+    def __init__(
+        self,
+        refresh_token,
+        base_64,
+        session: requests.Session = None,
+        url: str = None,
+        metrics: Metrics = None,
+    ):
+        """:url: token endpoint, to point at another accounts service (e.g. a mock server)"""
         self.refresh_token = refresh_token
         self.base_64 = base_64
+        self.session = session if session is not None else requests.Session()
+        self.url = url or self._URL
+        self.metrics = metrics
 
     def refresh(self):
-        url = "https://accounts.spotify.com/api/token"
-        response = requests.post(
-            url,
+        return self.fetch()[0]
+
+    def fetch(self) -> tuple[str, float]:
+        """New access token and its expiry (epoch seconds)."""
+        requested_at = time.time()
+        started = time.perf_counter()
+        response = self.session.post(
+            self.url,
             data={"grant_type": "refresh_token", "refresh_token": self.refresh_token},
             headers={"Authorization": "Basic " + self.base_64},
         )
+        if self.metrics is not None:
+            self.metrics.record(
+                "POST",
+                "token",
+                response.status_code,
+                started,
+                bytes=len(response.content),
+            )
+        if not response.ok:
+            raise Exception(response.status_code, response.reason, response.text)
         response_json = response.json()
-        return response_json["access_token"]
+        expires_at = requested_at + response_json.get("expires_in", 3600)
+        return response_json["access_token"], expires_at
+
+
+class TokenManager:
+    """Access token of a Refresh, renewed 'margin' seconds before it expires by one caller
+    at a time, the others waiting for it.
+    With 'path', the token and its expiry are also kept in that file, so that the processes
+    sharing it (e.g. the jobs of the compose services) reuse it instead of each getting one."""
+
+    def __init__(self, refresh: Refresh, path: str = None, margin: float = 300):
+        self.refresh = refresh
+        self.path = Path(path) if path else None
+        self.margin = margin
+        self.refreshes = 0
+        self._key = hashlib.sha256(refresh.refresh_token.encode()).hexdigest()[:16]
+        self._lock = threading.Lock()
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._rejected: str | None = None
+
+    def fresh(self) -> str | None:
+        """The current token, None if it has to be refreshed first (see 'get')."""
+        if self._token is not None and time.time() < self._expires_at - self.margin:
+            return self._token
+        return None
+
+    def get(self) -> str:
+        """A token valid for at least 'margin' seconds."""
+        token = self.fresh()
+        if token is not None:
+            return token
+        with self._lock, self._file_lock():
+            self._load()
+            token = self.fresh()
+            if token is None:
+                token, self._expires_at = self.refresh.fetch()
+                self._token = token
+                self.refreshes += 1
+                self._save()
+            return token
+
+    def invalidate(self, token: str) -> None:
+        """Forget 'token' (rejected with a 401), unless it was already replaced."""
+        with self._lock:
+            self._rejected = token
+            if self._token == token:
+                self._token = None
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if self.path is None or fcntl is None:
+            yield
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self) -> None:
+        if self.path is None:
+            return
+        entry = self._read().get(self._key)
+        if entry and entry["access_token"] != self._rejected:
+            self._token, self._expires_at = entry["access_token"], entry["expires_at"]
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        tokens = self._read()
+        tokens[self._key] = {
+            "access_token": self._token,
+            "expires_at": self._expires_at,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(tokens, f)
+        os.replace(tmp, self.path)
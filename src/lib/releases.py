@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import logging
+from itertools import chain
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+from lib.concurrency import afan_out, fan_out
+from lib.models import TrackIndex
+from lib.utils import n_chunks
+
+if TYPE_CHECKING:
+    from lib.async_client import AsyncSpotify
+    from lib.client import Spotify
+
+# what 'track_record' needs from the items of Spotify's Release Radar
+RADAR_FIELDS = "items(track(name,uri,artists(name),external_ids(isrc)))"
+
+
+def release_record(album: dict) -> dict:
+    """Keep only what 'albums_not_in_radar' and the release state need from an album object."""
+    return {
+        "id": album["id"],
+        "name": album["name"],
+        "artist": album["artists"][0]["name"],
+        "release_date": album["release_date"],
+    }
+
+
+def track_record(track: dict) -> dict:
+    """Keep only what 'tracks_uris' and TrackIndex need from a track object."""
+    return {
+        "name": track["name"],
+        "uri": track["uri"],
+        "artists": [artist["name"] for artist in track["artists"]],
+        "isrc": track.get("external_ids", {}).get("isrc"),
+    }
+
+
+def albums_not_in_radar(new_albums: Iterable[dict], radar: TrackIndex) -> list[str]:
+    """Ids of the new releases that are not in Spotify's Release Radar (e.g. a single whose
+    song is in it), one per title and artist."""
+    seen = TrackIndex()
+    album_ids = []
+    for album in new_albums:
+        if radar.has_title(album["name"], album["artist"]):
+            continue
+        if seen.add({"name": album["name"], "artists": [album["artist"]]}):
+            album_ids.append(album["id"])
+    return album_ids
+
+
+def tracks_uris(
+    tracks: Iterable[dict], artists_names: list[str], radar: TrackIndex
+) -> Iterator[str]:
+    """Uris of the tracks featuring one of 'artists_names', not in Spotify's Release Radar,
+    one version of each song (the first one: clean/explicit, remastered, ...)."""
+    artists_names = set(artists_names)
+    seen = TrackIndex()
+    for track in tracks:
+        if track in radar or not seen.add(track):
+            continue
+        if artists_names.intersection(track["artists"]):
+            yield track["uri"]
+
+
+def fetch_tracks(
+    spotify: Spotify,
+    album_ids: list[str],
+    max_workers: int = 8,
+    logger: logging.Logger = None,
+) -> list[dict]:
+    """Records of the tracks of 'album_ids', in order: 20 albums then 50 tracks (for their
+    ISRC) per request, the chunks of albums fetched concurrently.
+    Raise if some chunks failed, their releases must not be considered handled."""
+
+    def get_tracks(album_ids: list[str]) -> list[dict]:
+        ids = []
+        for album in spotify.get_albums(album_ids):
+            if album is None:
+                continue
+            ids += [x["id"] for x in album["tracks"]["items"]]
+            if album["tracks"]["next"] is not None:
+                offset = len(album["tracks"]["items"])
+                rest = spotify.iter_album_tracks(album["id"], offset=offset)
+                ids += [x["id"] for x in rest]
+        return [track_record(x) for x in spotify.get_tracks(ids) if x is not None]
+
+    chunks = fan_out(
+        get_tracks,
+        n_chunks(album_ids, chunk_size=20),
+        max_workers=max_workers,
+        logger=logger,
+    )
+    return _joined(chunks)
+
+
+async def afetch_tracks(
+    spotify: AsyncSpotify,
+    album_ids: list[str],
+    max_in_flight: int = 8,
+    logger: logging.Logger = None,
+) -> list[dict]:
+    """asyncio version of 'fetch_tracks'."""
+
+    async def get_tracks(album_ids: list[str]) -> list[dict]:
+        ids = []
+        for album in await spotify.get_albums(album_ids):
+            if album is None:
+                continue
+            ids += [x["id"] for x in album["tracks"]["items"]]
+            if album["tracks"]["next"] is not None:
+                offset = len(album["tracks"]["items"])
+                rest = spotify.iter_album_tracks(album["id"], offset=offset)
+                ids += [x["id"] async for x in rest]
+        return [track_record(x) for x in await spotify.get_tracks(ids) if x is not None]
+
+    chunks = await afan_out(
+        get_tracks,
+        n_chunks(album_ids, chunk_size=20),
+        max_in_flight=max_in_flight,
+        logger=logger,
+    )
+    return _joined(chunks)
+
+
+def _joined(chunks: list[list[dict] | None]) -> list[dict]:
+    """Concatenate the chunks of tracks, failed ones (None) making the whole fetch fail."""
+    failed = chunks.count(None)
+    if failed:
+        raise Exception(f"Failed to get the tracks of {failed} chunk(s) of albums.")
+    return list(chain.from_iterable(chunks))
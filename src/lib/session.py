@@ -0,0 +1,75 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter keeping track of the connections opened vs. reused by its pools."""
+
+    def connection_stats(self) -> dict:
+        """Return the number of requests sent and connections opened/reused."""
+        opened, sent = 0, 0
+        for key in self.poolmanager.pools.keys():
+            pool = self.poolmanager.pools.get(key)
+            if pool is None:  # evicted in the meantime
+                continue
+            opened += pool.num_connections
+            sent += pool.num_requests
+        return {"requests": sent, "opened": opened, "reused": max(sent - opened, 0)}
+
+
+class ConnectionTrace:
+    """httpx request hook counting the requests sent and connections opened by an
+    AsyncClient (through the 'trace' extension), the counterpart of PooledAdapter."""
+
+    def __init__(self):
+        self.requests = 0
+        self.opened = 0
+
+    async def __call__(self, request) -> None:
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event: str, info: dict) -> None:
+        if event == "connection.connect_tcp.complete":
+            self.opened += 1
+        elif event.endswith(".send_request_headers.complete"):
+            self.requests += 1
+
+    def connection_stats(self) -> dict:
+        """Return the number of requests sent and connections opened/reused."""
+        return {
+            "requests": self.requests,
+            "opened": self.opened,
+            "reused": max(self.requests - self.opened, 0),
+        }
+
+
+def create_session(pool_connections: int = 4, pool_size: int = 16) -> requests.Session:
+    """Create a keep-alive session backed by a connection pool.
+    :pool_connections: number of hosts to keep a pool for
+    :pool_size: max number of connections kept alive per host"""
+    session = requests.Session()
+    adapter = PooledAdapter(pool_connections=pool_connections, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def connection_stats(session: requests.Session) -> dict:
+    """Aggregate connection stats of every pooled adapter mounted on a session."""
+    stats = {"requests": 0, "opened": 0, "reused": 0}
+    adapters = {id(a): a for a in session.adapters.values()}.values()
+    for adapter in adapters:
+        if isinstance(adapter, PooledAdapter):
+            for k, v in adapter.connection_stats().items():
+                stats[k] += v
+    return stats
+
+
+def async_connection_stats(client) -> dict:
+    """Aggregate connection stats of every ConnectionTrace hooked on an httpx.AsyncClient."""
+    stats = {"requests": 0, "opened": 0, "reused": 0}
+    for hook in client.event_hooks["request"]:
+        if isinstance(hook, ConnectionTrace):
+            for k, v in hook.connection_stats().items():
+                stats[k] += v
+    return stats
@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+
+class ReleaseState:
+    """SQLite store of what a job already processed, per artist: when it was last checked,
+    its latest release (the watermark) and the releases already handled.
+    Nothing is written until 'commit', to be called once the job's side effects are done,
+    so a crashed run is simply replayed (cheaply, thanks to the response cache)."""
+
+    def __init__(self, job: str, path: str = ".cache/state.sqlite"):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.job = job
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS artists ("
+            "job TEXT, artist_id TEXT, last_release_id TEXT, last_release_date TEXT, "
+            "last_checked REAL, PRIMARY KEY (job, artist_id));"
+            "CREATE TABLE IF NOT EXISTS releases ("
+            "job TEXT, release_id TEXT, artist_id TEXT, release_date TEXT, "
+            "PRIMARY KEY (job, release_id));"
+            "CREATE TABLE IF NOT EXISTS meta ("
+            "job TEXT, key TEXT, value TEXT, PRIMARY KEY (job, key));"
+        )
+        self._checked: set[str] = set()
+        self._releases: dict[str, tuple[str, str]] = {}
+
+    def due(self, artist_ids: list[str], max_age: float) -> list[str]:
+        """Artists not checked within the last 'max_age' seconds, in input order."""
+        with self._lock:
+            fresh = {
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT artist_id FROM artists WHERE job = ? AND last_checked >= ?",
+                    (self.job, time.time() - max_age),
+                )
+            }
+        return [artist_id for artist_id in artist_ids if artist_id not in fresh]
+
+    def since(self, artist_id: str, default: date) -> date:
+        """Start of the release window of an artist: its watermark, if more recent than 'default'.
+        Releases of that very day may not all be handled yet, 'unseen' sorts them out."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_release_date FROM artists WHERE job = ? AND artist_id = ?",
+                (self.job, artist_id),
+            ).fetchone()
+        if row is None or row[0] is None:
+            return default
+        return max(default, _to_date(row[0]))
+
+    def unseen(self, release_ids: list[str]) -> list[str]:
+        """Drop the releases handled by a previous run."""
+        if not release_ids:
+            return []
+        with self._lock:
+            seen = {
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT release_id FROM releases WHERE job = ? AND release_id IN "
+                    f"({','.join('?' * len(release_ids))})",
+                    (self.job, *release_ids),
+                )
+            }
+        return [release_id for release_id in release_ids if release_id not in seen]
+
+    def checked(self, artist_id: str, releases: list[tuple[str, str]] = ()) -> None:
+        """Stage an artist as checked, with its new '(release_id, release_date)'."""
+        with self._lock:
+            self._checked.add(artist_id)
+            for release_id, release_date in releases:
+                self._releases[release_id] = (artist_id, release_date)
+
+    def commit(self) -> None:
+        """Persist everything staged since the last commit."""
+        now = time.time()
+        with self._lock:
+            latest: dict[str, tuple[str, str]] = {}
+            for release_id, (artist_id, release_date) in self._releases.items():
+                if release_date > latest.get(artist_id, ("", ""))[1]:
+                    latest[artist_id] = (release_id, release_date)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO releases VALUES (?, ?, ?, ?)",
+                [
+                    (self.job, release_id, artist_id, release_date)
+                    for release_id, (artist_id, release_date) in self._releases.items()
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO artists VALUES (?, ?, NULL, NULL, ?) "
+                "ON CONFLICT (job, artist_id) DO UPDATE SET last_checked = excluded.last_checked",
+                [(self.job, artist_id, now) for artist_id in self._checked],
+            )
+            self._conn.executemany(
+                "UPDATE artists SET last_release_id = ?, last_release_date = ? "
+                "WHERE job = ? AND artist_id = ? "
+                "AND (last_release_date IS NULL OR last_release_date <= ?)",
+                [
+                    (release_id, release_date, self.job, artist_id, release_date)
+                    for artist_id, (release_id, release_date) in latest.items()
+                ],
+            )
+            self._conn.commit()
+            self._checked.clear()
+            self._releases.clear()
+
+    def prune(self, before: date) -> None:
+        """Forget the releases older than 'before', they can't show up in a window anymore."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM releases WHERE job = ? AND release_date < ?",
+                (self.job, before.isoformat()),
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE job = ? AND key = ?", (self.job, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?, ?)", (self.job, key, value)
+            )
+            self._conn.commit()
+
+
+def _to_date(release_date: str) -> date:
+    """Parse a release date, whatever its precision ('year', 'month' or 'day')."""
+    parts = [int(x) for x in release_date.split("-")]
+    return date(*parts, *[1] * (3 - len(parts)))
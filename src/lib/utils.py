@@ -1,8 +1,5 @@
-def backoff_hdlr(details: dict) -> None:
-    print(
-        f"Backing off {details['wait']:0.1f} seconds after {details['tries']} tries "
-        f"calling function {details['target'].__name__}\nDetails: {details}"
-    )
+import re
+import unicodedata
 
 
 def remove_nones(original: dict):
@@ -15,3 +12,20 @@ def n_chunks(ls, chunk_size=50):
         chunk = ls[i : i + chunk_size]
         super_ls.append(chunk)
     return super_ls
+
+
+def fold(name: str) -> str:
+    """'name' compared regardless of case, accents and spacing: ' Beyoncé ' -> 'beyonce'."""
+    letters = unicodedata.normalize("NFKD", name)
+    letters = "".join(c for c in letters if not unicodedata.combining(c))
+    return " ".join(letters.casefold().split())
+
+
+# mentions of a track's version that don't make it another song
+_VERSION = r"[^()\[\]]*\b(?:remaster(?:ed)?|clean|explicit)\b[^()\[\]]*"
+_VERSIONS = re.compile(rf"\s*(?:[(\[]{_VERSION}[)\]]|\s-\s{_VERSION}$)", re.IGNORECASE)
+
+
+def track_title(name: str) -> str:
+    """Folded title of a track without its version: 'Song - 2011 Remaster' -> 'song'."""
+    return fold(_VERSIONS.sub("", name))